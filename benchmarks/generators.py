@@ -0,0 +1,347 @@
+import datetime as dt
+import numpy as np
+
+# All generators are seeded so two runs with the same arguments produce the same payloads.
+# Shapes follow what the real APIs return, so the library functions can consume them unchanged.
+
+BASE_DATETIME = dt.datetime(2022, 1, 1)
+
+HS_DEAL_PROPERTIES = [
+  'hs_object_id', 'dealname', 'dealstage', 'pipeline', 'amount', 'closedate', 'createdate',
+  'hs_lastmodifieddate', 'hubspot_owner_id', 'hs_is_closed', 'num_associated_contacts', 'description'
+  ]
+
+HS_PARSE_COLUMN = {
+  'to_integer': ['num_associated_contacts'],
+  'to_datetime': ['closedate', 'createdate', 'hs_lastmodifieddate'],
+  'to_numeric': ['amount'],
+  'to_boolean': ['hs_is_closed']
+  }
+
+def _rng(seed):
+
+  return np.random.default_rng(seed)
+
+def _epoch_ms(rng, n, days = 730):
+
+  offsets = rng.integers(0, days * 86400, n)
+  base = int(BASE_DATETIME.timestamp())
+
+  return (base + offsets) * 1000
+
+def hubspot_objects(n, seed = 0, associations = True):
+
+  """
+  Synthetic deals in the legacy 'recently modified' format
+
+  n: int number of objects
+  seed: int random seed
+  associations: bool include associatedCompanyIds and associatedVids
+
+  return: list of dicts as found in response['results']
+  """
+
+  rng = _rng(seed)
+  ids = np.arange(1, n + 1) + 1000000
+  stages = ['appointmentscheduled', 'qualifiedtobuy', 'contractsent', 'closedwon', 'closedlost']
+  stage_idx = rng.integers(0, len(stages), n)
+  amounts = rng.gamma(2, 1500, n).round(2)
+  created = _epoch_ms(rng, n)
+  modified = created + rng.integers(0, 30 * 86400, n) * 1000
+  closed = modified + rng.integers(0, 60 * 86400, n) * 1000
+  owners = rng.integers(100, 140, n)
+  n_contacts = rng.integers(0, 6, n)
+  companies = rng.integers(5000, 9000, n)
+
+  objects = []
+  for i in range(n):
+    props = {
+      'hs_object_id': str(ids[i]),
+      'dealname': f'Deal {ids[i]}',
+      'dealstage': stages[stage_idx[i]],
+      'pipeline': 'default',
+      'amount': str(amounts[i]) if i % 17 else '',
+      'closedate': str(closed[i]),
+      'createdate': str(created[i]),
+      'hs_lastmodifieddate': str(modified[i]),
+      'hubspot_owner_id': str(owners[i]),
+      'hs_is_closed': 'true' if stage_idx[i] >= 3 else 'false',
+      'num_associated_contacts': str(n_contacts[i]),
+      'description': 'lorem ipsum dolor sit amet ' * (i % 4)
+      }
+    obj = {
+      'portalId': 62515,
+      'dealId': int(ids[i]),
+      'isDeleted': False,
+      'properties': {k: {'value': v, 'timestamp': int(modified[i]), 'source': 'CRM_UI', 'sourceId': None, 'versions': []} for k, v in props.items()}
+      }
+    if associations:
+      obj['associations'] = {
+        'associatedVids': [int(x) for x in rng.integers(1, 100000, n_contacts[i])],
+        'associatedCompanyIds': [int(companies[i])],
+        'associatedDealIds': []
+        }
+    objects.append(obj)
+
+  return objects
+
+def hubspot_search_objects(n, seed = 0):
+
+  """
+  Synthetic deals in the CRM v3 format returned by the search API
+
+  n: int number of objects
+  seed: int random seed
+
+  return: list of dicts with id, properties (plain values), createdAt, updatedAt and archived
+  """
+
+  objects = []
+  for legacy in hubspot_objects(n, seed = seed, associations = False):
+    props = {k: v['value'] for k, v in legacy['properties'].items()}
+    created = dt.datetime.fromtimestamp(int(props['createdate']) / 1000, dt.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    updated = dt.datetime.fromtimestamp(int(props['hs_lastmodifieddate']) / 1000, dt.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    props['createdate'], props['hs_lastmodifieddate'] = created, updated
+    objects.append({'id': str(legacy['dealId']), 'properties': props, 'createdAt': created, 'updatedAt': updated, 'archived': False})
+
+  return objects
+
+def hubspot_pages(objects, page_size = 100):
+
+  """
+  Split objects in pages as served by the legacy offset pagination
+
+  objects: list output of hubspot_objects
+  page_size: int objects per page
+
+  return: list of response dicts with results, hasMore and offset
+  """
+
+  pages = []
+  for start in range(0, max(len(objects), 1), page_size):
+    end = start + page_size
+    pages.append({'results': objects[start:end], 'hasMore': end < len(objects), 'offset': end, 'total': len(objects)})
+
+  return pages
+
+def _many2one(rng, n, prefix, cardinality, null_share = 0.0):
+
+  ids = rng.integers(1, cardinality + 1, n)
+  nulls = rng.random(n) < null_share
+
+  return [False if nulls[i] else [int(ids[i]), f'{prefix} {ids[i]}'] for i in range(n)]
+
+def odoo_move_lines(n, seed = 0):
+
+  """
+  Synthetic account.move.line records as returned by search_read
+
+  n: int number of records
+  seed: int random seed
+
+  return: list of dicts
+  """
+
+  rng = _rng(seed)
+  dates = np.datetime64(BASE_DATETIME, 's') + rng.integers(0, 730, n).astype('timedelta64[D]')
+  write_offsets = rng.integers(0, 86400, n)
+  debit = rng.gamma(2, 250, n).round(2)
+  is_debit = rng.random(n) < 0.5
+  tags = rng.integers(1, 40, n)
+  has_tag = rng.random(n) < 0.6
+
+  account_id = _many2one(rng, n, '110101 Account', 300)
+  move_id = _many2one(rng, n, 'INV/2022', max(n // 4, 1))
+  company_id = _many2one(rng, n, 'Company', 3)
+  partner_id = _many2one(rng, n, 'Partner', 2000, null_share = 0.1)
+  currency_id = _many2one(rng, n, 'Currency', 4)
+  journal_id = _many2one(rng, n, 'Journal', 12)
+  country_id = _many2one(rng, n, 'Country', 2)
+  analytic_id = _many2one(rng, n, 'Analytic', 60, null_share = 0.3)
+
+  records = []
+  for i in range(n):
+    date = dates[i].astype('datetime64[s]').astype(dt.datetime)
+    amount = float(debit[i])
+    records.append({
+      'id': i + 1,
+      'name': f'Line {i + 1}',
+      'date': date.strftime('%Y-%m-%d'),
+      'write_date': (date + dt.timedelta(seconds = int(write_offsets[i]))).strftime('%Y-%m-%d %H:%M:%S'),
+      'account_id': account_id[i],
+      'move_id': move_id[i],
+      'company_id': company_id[i],
+      'partner_id': partner_id[i],
+      'currency_id': currency_id[i],
+      'journal_id': journal_id[i],
+      'tax_fiscal_country_id': country_id[i],
+      'analytic_account_id': analytic_id[i],
+      'analytic_tag_ids': [int(tags[i])] if has_tag[i] else [],
+      'debit': amount if is_debit[i] else 0.0,
+      'credit': 0.0 if is_debit[i] else amount,
+      'balance': amount if is_debit[i] else -amount
+      })
+
+  return records
+
+def odoo_accounts(n, seed = 0):
+
+  """
+  Synthetic account.account records with ' - ' separated hierarchical names
+
+  n: int number of records
+  seed: int random seed
+
+  return: list of dicts
+  """
+
+  rng = _rng(seed)
+  levels = ['Assets', 'Liabilities', 'Equity', 'Income', 'Expenses']
+  depth = rng.integers(1, 5, n)
+  level_idx = rng.integers(0, len(levels), n)
+
+  records = []
+  for i in range(n):
+    name = ' - '.join([levels[level_idx[i]]] + [f'Group {j}{i % 7}' for j in range(1, depth[i])])
+    records.append({
+      'id': i + 1,
+      'name': name,
+      'code': f'{110000 + i}',
+      'write_date': (BASE_DATETIME + dt.timedelta(minutes = i)).strftime('%Y-%m-%d %H:%M:%S')
+      })
+
+  return records
+
+def odoo_currency_rates(n, seed = 0):
+
+  """
+  Synthetic res.currency.rate records
+
+  n: int number of records
+  seed: int random seed
+
+  return: list of dicts
+  """
+
+  rng = _rng(seed)
+  rates = rng.normal(4.5, 0.3, n).round(6)
+  company_id = _many2one(rng, n, 'Company', 3)
+  currency_id = _many2one(rng, n, 'Currency', 4)
+
+  records = []
+  for i in range(n):
+    day = BASE_DATETIME + dt.timedelta(days = i // 4)
+    records.append({
+      'id': i + 1,
+      'name': day.strftime('%Y-%m-%d'),
+      'rate': float(rates[i]),
+      'company_id': company_id[i],
+      'currency_id': currency_id[i],
+      'write_date': day.strftime('%Y-%m-%d %H:%M:%S')
+      })
+
+  return records
+
+def graph_media(n, seed = 0):
+
+  """
+  Synthetic response of the instagram '/media' edge
+
+  n: int number of media objects
+  seed: int random seed
+
+  return: dict with 'data' list
+  """
+
+  rng = _rng(seed)
+  offsets = rng.integers(0, 365 * 86400, n)
+  likes = rng.integers(0, 5000, n)
+  media_types = ['IMAGE', 'VIDEO', 'CAROUSEL_ALBUM']
+
+  data = []
+  for i in range(n):
+    timestamp = BASE_DATETIME + dt.timedelta(seconds = int(offsets[i]))
+    data.append({
+      'id': str(17800000000000000 + i),
+      'caption': f'Post {i}',
+      'media_type': media_types[i % 3],
+      'like_count': int(likes[i]),
+      'comments_count': int(likes[i] // 20),
+      'timestamp': timestamp.strftime('%Y-%m-%dT%H:%M:%S+0000')
+      })
+
+  return {'data': data}
+
+def graph_media_insights(media_id, seed = 0):
+
+  """
+  Synthetic response of '/{media_id}/insights' for engagement, impressions, reach and saved
+
+  media_id: str
+  seed: int random seed
+
+  return: dict with 'data' list
+  """
+
+  rng = _rng([seed, int(media_id) % (2 ** 32)])
+  values = rng.integers(0, 10000, 4)
+  names = ['engagement', 'impressions', 'reach', 'saved']
+
+  data = [
+    {'name': name, 'period': 'lifetime', 'values': [{'value': int(value)}], 'id': f'{media_id}/insights/{name}/lifetime'}
+    for name, value in zip(names, values)
+    ]
+
+  return {'data': data}
+
+def graph_user_insights(days, seed = 0):
+
+  """
+  Synthetic response of the account '/insights' edge with daily period
+
+  days: int number of days
+  seed: int random seed
+
+  return: dict with 'data' list
+  """
+
+  rng = _rng(seed)
+  names = ['email_contacts', 'follower_count', 'impressions', 'profile_views', 'reach', 'website_clicks']
+  end_times = [(BASE_DATETIME + dt.timedelta(days = d)).strftime('%Y-%m-%dT07:00:00+0000') for d in range(days)]
+
+  data = []
+  for name in names:
+    values = rng.integers(0, 3000, days)
+    data.append({'name': name, 'period': 'day', 'values': [{'value': int(v), 'end_time': t} for v, t in zip(values, end_times)]})
+
+  return {'data': data}
+
+def fulcrum_rows(n, seed = 0):
+
+  """
+  Synthetic response of a fulcrum query
+
+  n: int number of rows
+  seed: int random seed
+
+  return: dict with 'rows' list
+  """
+
+  rng = _rng(seed)
+  lat = rng.uniform(10.4, 10.6, n).round(6)
+  lon = rng.uniform(-67.0, -66.8, n).round(6)
+  statuses = ['pending', 'in_progress', 'done']
+  status_idx = rng.integers(0, 3, n)
+
+  rows = []
+  for i in range(n):
+    rows.append({
+      '_record_id': f'rec-{i:08d}',
+      '_status': statuses[status_idx[i]],
+      '_latitude': float(lat[i]),
+      '_longitude': float(lon[i]),
+      '_server_updated_at': (BASE_DATETIME + dt.timedelta(minutes = i)).strftime('%Y-%m-%dT%H:%M:%SZ'),
+      'inspector': f'inspector {i % 25}'
+      })
+
+  return {'rows': rows}
@@ -0,0 +1,105 @@
+"""
+Import time budgets for vikuatools
+
+Every module is imported in a fresh interpreter with -X importtime, so timings are cold and do
+not include interpreter startup. Besides the time budget, each module lists third party packages
+it must not import, which is what keeps a HubSpot-only job from paying for google-cloud-bigquery:
+
+  python -m benchmarks.imports --repeat 3
+
+The test suite only checks forbidden imports. Set VIKUATOOLS_IMPORT_TIMING=1 to check time budgets too.
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+HEAVY = ['pandas', 'numpy', 'pyarrow', 'requests', 'google.cloud.bigquery', 'fulcrum']
+
+# module: (budget in seconds, heavy packages it must not import)
+BUDGETS = {
+  'vikuatools': (0.05, HEAVY),
+  'vikuatools.instrument': (0.05, HEAVY),
+  'vikuatools.runner': (0.1, HEAVY),
+  'vikuatools.utils': (1.5, ['google.cloud.bigquery', 'fulcrum']),
+  'vikuatools.hubspot': (1.5, ['google.cloud.bigquery', 'fulcrum']),
+  'vikuatools.odoo': (1.5, ['google.cloud.bigquery', 'fulcrum']),
+  'vikuatools.instagram': (1.5, ['google.cloud.bigquery', 'fulcrum']),
+  'vikuatools.bigquery': (1.5, ['google.cloud.bigquery', 'fulcrum']),
+  'vikuatools.fulcrum': (1.5, ['google.cloud.bigquery', 'fulcrum']),
+  'vikuatools.schema': (1.5, ['google.cloud.bigquery', 'fulcrum']),
+  'vikuatools.spill': (1.5, ['google.cloud.bigquery', 'fulcrum']),
+  'vikuatools.parallel': (1.5, ['google.cloud.bigquery', 'fulcrum', 'requests'])
+  }
+
+def measure_import(module, repeat = 1):
+
+  """
+  Import module in fresh interpreters
+
+  module: str dotted module name
+  repeat: int number of interpreters, the best time is kept
+
+  return: dict with seconds (cumulative import time of module) and modules (sorted list of sys.modules after the import)
+  """
+
+  code = f'import {module}, sys, json; print(json.dumps(sorted(sys.modules)))'
+  timings = []
+  for _ in range(repeat):
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output = True, text = True, check = True)
+    for line in proc.stderr.splitlines():
+      # import time: self [us] | cumulative | imported package
+      fields = [x.strip() for x in line.split('|')]
+      if len(fields) == 3 and fields[2] == module:
+        timings.append(int(fields[1]) / 1e6)
+    modules = json.loads(proc.stdout)
+
+  return {'seconds': min(timings), 'modules': modules}
+
+def check(budgets = None, repeat = 1, timing = True):
+
+  """
+  Measure every module of budgets
+
+  budgets: dict module -> (seconds, forbidden packages), default BUDGETS
+  repeat: int interpreters per module
+  timing: bool report modules over their time budget. If False only forbidden imports are violations, wall
+    clock budgets are not reliable on a loaded machine
+
+  return: tuple with dict module -> seconds and list of violation messages
+  """
+
+  results = {}
+  violations = []
+  for module, (budget, forbidden) in (budgets or BUDGETS).items():
+    measured = measure_import(module, repeat)
+    results[module] = measured['seconds']
+    if timing and measured['seconds'] > budget:
+      violations.append(f"{module} imports in {measured['seconds']:.3f}s, budget {budget:.3f}s")
+    imported = sorted(set(forbidden) & set(measured['modules']))
+    if imported:
+      violations.append(f"{module} imports {', '.join(imported)} at load time")
+
+  return results, violations
+
+def main(argv = None):
+
+  parser = argparse.ArgumentParser(description = 'Check vikuatools import time budgets')
+  parser.add_argument('--repeat', type = int, default = 3)
+  parser.add_argument('--module', action = 'append', choices = list(BUDGETS), help = 'modules to check, default all')
+  args = parser.parse_args(argv)
+
+  budgets = {m: BUDGETS[m] for m in args.module} if args.module else BUDGETS
+  results, violations = check(budgets, args.repeat)
+
+  print(f"{'module':<26}{'seconds':>10}{'budget':>10}")
+  for module, seconds in results.items():
+    print(f'{module:<26}{seconds:>10.4f}{budgets[module][0]:>10.3f}')
+  for violation in violations:
+    print(f'OVER BUDGET {violation}')
+
+  return 1 if violations else 0
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,247 @@
+"""
+Benchmark suite for vikuatools
+
+Every stage runs a library function over seeded synthetic payloads, served through local
+HTTP/XML-RPC stand-ins and a fake BigQuery client where the function talks to a service.
+Each stage reports wall time (best of --repeat runs) and peak traced memory, and can be
+compared against a saved baseline:
+
+  python -m benchmarks.run --rows 100000 --save-baseline benchmarks/baseline.json
+  python -m benchmarks.run --rows 100000 --baseline benchmarks/baseline.json --fail-on-regression
+
+Baselines are keyed by stage and row count, so one file can hold several scales.
+"""
+
+import argparse
+import copy
+import gc
+import json
+import sys
+import time
+import tracemalloc
+import xmlrpc.client
+import pandas as pd
+
+from benchmarks import generators, standins
+from vikuatools import bigquery, fulcrum, hubspot, instagram, odoo, utils
+
+def measure(fun, repeat = 1):
+
+  """
+  Run fun() repeat times for timing and once more under tracemalloc for peak memory
+
+  fun: callable without arguments
+  repeat: int number of timed runs
+
+  return: dict with seconds (best run) and peak_mb
+  """
+
+  timings = []
+  for _ in range(repeat):
+    gc.collect()
+    start = time.perf_counter()
+    fun()
+    timings.append(time.perf_counter() - start)
+
+  gc.collect()
+  tracemalloc.start()
+  try:
+    fun()
+    _, peak = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+
+  return {'seconds': min(timings), 'peak_mb': peak / 2 ** 20}
+
+def _hubspot_stages(rows, seed):
+
+  objects = generators.hubspot_objects(rows, seed = seed)
+  properties = generators.HS_DEAL_PROPERTIES
+  extracted = hubspot.hs_extract_value(objects, properties)
+
+  def fetch():
+    with standins.LocalHTTPServer(standins.hubspot_routes(objects)) as server:
+      url = server.url + '/deals/v1/deal/recent/modified?'
+      hubspot.hs_get_recent_modified(url, {'count': 100}, max_results = rows + 1)
+
+  search_objects = generators.hubspot_search_objects(rows, seed = seed)
+
+  def search():
+    with standins.LocalHTTPServer(standins.hubspot_search_routes(search_objects)) as server:
+      hubspot.hs_search_modified('deals', 'token', generators.BASE_DATETIME, generators.BASE_DATETIME.replace(year = 2025), properties, page_size = 200, base_url = server.url)
+
+  def clean():
+    hubspot.clean_hubspot_response(objects, properties, copy.deepcopy(generators.HS_PARSE_COLUMN), hubspot.hs_extract_value)
+
+  return {
+    'hs_get_recent_modified': (fetch, rows),
+    'hs_search_modified': (search, rows),
+    'hs_extract_value': (lambda: hubspot.hs_extract_value(objects, properties), rows),
+    'parse_properties': (lambda: utils.parse_properties(extracted.copy(), **{'columns_' + k: v for k, v in generators.HS_PARSE_COLUMN.items()}), rows),
+    'clean_hubspot_response': (clean, rows)
+    }
+
+def _odoo_stages(rows, seed):
+
+  move_lines = generators.odoo_move_lines(rows, seed = seed)
+  rates = generators.odoo_currency_rates(rows, seed = seed)
+  accounts = generators.odoo_accounts(min(rows, 100000), seed = seed)
+  move_line_df = pd.DataFrame(move_lines)
+  rates_df = pd.DataFrame(rates)
+  accounts_df = pd.DataFrame(accounts).rename(columns = {'name': 'account_name'})
+  fields = list(move_lines[0].keys())
+
+  def fetch():
+    with standins.LocalXmlRpcServer({'account.move.line': move_lines}) as server:
+      model = xmlrpc.client.ServerProxy(server.url + '/xmlrpc/2/object', allow_none = True)
+      odoo.get_odoo_model(model, 'db', 2, 'pwd', 'account.move.line', fields)
+
+  def fetch_jsonrpc():
+    standin = standins.OdooStandin({'account.move.line': move_lines})
+    with standins.LocalHTTPServer(standins.odoo_jsonrpc_routes(standin)) as server:
+      odoo.get_odoo_model(odoo.odoo_transport(server.url, 'jsonrpc'), 'db', 2, 'pwd', 'account.move.line', fields)
+
+  return {
+    'get_odoo_model': (fetch, rows),
+    'get_odoo_model_jsonrpc': (fetch_jsonrpc, rows),
+    'clean_move_line': (lambda: odoo.clean_move_line(move_line_df), rows),
+    'clean_currency_rate': (lambda: odoo.clean_currency_rate(rates_df), rows),
+    'split_column': (lambda: odoo.split_column(accounts_df, column_to_split = 'account_name'), len(accounts))
+    }
+
+def _instagram_stages(rows, seed):
+
+  n_media = min(rows, 500)
+  media = generators.graph_media(n_media, seed = seed)
+
+  def media_insight():
+    routes = standins.graph_routes(media, lambda media_id: generators.graph_media_insights(media_id, seed = seed))
+    with standins.LocalHTTPServer(routes) as server:
+      instagram.ig_media_insight(media, {'endpoint_base': server.url + '/', 'access_token': 'token'})
+
+  return {'ig_media_insight': (media_insight, n_media)}
+
+def _fulcrum_stages(rows, seed):
+
+  client = standins.FakeFulcrumClient(generators.fulcrum_rows(rows, seed = seed))
+
+  return {'query_to_df': (lambda: fulcrum.query_to_df(client, 'SELECT * FROM "inspections"'), rows)}
+
+def _bigquery_stages(rows, seed):
+
+  df = odoo.clean_move_line(pd.DataFrame(generators.odoo_move_lines(rows, seed = seed)))
+  existing = df.iloc[: rows // 2].copy()
+  table_id = 'project.dataset.move_line'
+
+  def load():
+    client = standins.FakeBigQueryClient({table_id: existing})
+    bigquery.load_table_from_dataframe_safely(client, df, table_id, drop_id_field = 'id')
+
+  return {'load_table_from_dataframe_safely': (load, rows)}
+
+SUITES = {
+  'hubspot': _hubspot_stages,
+  'odoo': _odoo_stages,
+  'instagram': _instagram_stages,
+  'fulcrum': _fulcrum_stages,
+  'bigquery': _bigquery_stages
+  }
+
+def run(rows = 1000, seed = 0, suites = None, stages = None, repeat = 1):
+
+  """
+  Run benchmark stages
+
+  rows: int scale of the synthetic payloads
+  seed: int random seed for the generators
+  suites: list of suite names, default all of SUITES
+  stages: list of stage names to keep, default all
+  repeat: int timed runs per stage
+
+  return: dict stage -> {'rows', 'seconds', 'peak_mb'}
+  """
+
+  results = {}
+  for suite in suites or list(SUITES):
+    for stage, (fun, n) in SUITES[suite](rows, seed).items():
+      if stages and stage not in stages:
+        continue
+      results[stage] = {'rows': n, **measure(fun, repeat)}
+
+  return results
+
+def compare(results, baseline, tolerance = 1.25):
+
+  """
+  Compare results against a baseline recorded for the same row counts
+
+  results: dict output of run
+  baseline: dict with the same structure, keyed by f'{stage}@{rows}'
+  tolerance: float ratio over baseline time or memory considered a regression
+
+  return: list of (stage, metric, baseline, current, ratio) regressions
+  """
+
+  regressions = []
+  for stage, current in results.items():
+    reference = baseline.get(f"{stage}@{current['rows']}")
+    if not reference:
+      continue
+    for metric in ['seconds', 'peak_mb']:
+      ratio = current[metric] / reference[metric] if reference[metric] else 1.0
+      current[f'{metric}_ratio'] = ratio
+      if ratio > tolerance:
+        regressions.append((stage, metric, reference[metric], current[metric], ratio))
+
+  return regressions
+
+def _report(results):
+
+  lines = [f"{'stage':<34}{'rows':>10}{'seconds':>12}{'peak MB':>12}{'x time':>9}{'x mem':>9}"]
+  for stage, r in results.items():
+    ratios = ''.join(f"{r[k]:>9.2f}" if k in r else f"{'-':>9}" for k in ['seconds_ratio', 'peak_mb_ratio'])
+    lines.append(f"{stage:<34}{r['rows']:>10}{r['seconds']:>12.4f}{r['peak_mb']:>12.1f}{ratios}")
+
+  return '\n'.join(lines)
+
+def main(argv = None):
+
+  parser = argparse.ArgumentParser(description = 'Benchmark vikuatools stages on synthetic payloads')
+  parser.add_argument('--rows', type = int, default = 1000, help = 'payload scale, 1k to 10M')
+  parser.add_argument('--seed', type = int, default = 0)
+  parser.add_argument('--repeat', type = int, default = 1)
+  parser.add_argument('--suite', action = 'append', choices = list(SUITES), help = 'suites to run, default all')
+  parser.add_argument('--stage', action = 'append', help = 'stages to run, default all')
+  parser.add_argument('--baseline', help = 'baseline json to compare against')
+  parser.add_argument('--save-baseline', help = 'write results into this baseline json')
+  parser.add_argument('--tolerance', type = float, default = 1.25)
+  parser.add_argument('--fail-on-regression', action = 'store_true')
+  args = parser.parse_args(argv)
+
+  results = run(rows = args.rows, seed = args.seed, suites = args.suite, stages = args.stage, repeat = args.repeat)
+
+  regressions = []
+  if args.baseline:
+    with open(args.baseline) as f:
+      regressions = compare(results, json.load(f), args.tolerance)
+
+  print(_report(results))
+
+  for stage, metric, reference, current, ratio in regressions:
+    print(f'REGRESSION {stage} {metric}: {reference:.4f} -> {current:.4f} ({ratio:.2f}x)')
+
+  if args.save_baseline:
+    try:
+      with open(args.save_baseline) as f:
+        saved = json.load(f)
+    except FileNotFoundError:
+      saved = {}
+    for stage, r in results.items():
+      saved[f"{stage}@{r['rows']}"] = {'rows': r['rows'], 'seconds': r['seconds'], 'peak_mb': r['peak_mb']}
+    with open(args.save_baseline, 'w') as f:
+      json.dump(saved, f, indent = 2, sort_keys = True)
+
+  return 1 if regressions and args.fail_on_regression else 0
+
+if __name__ == '__main__':
+  sys.exit(main())
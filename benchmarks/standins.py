@@ -0,0 +1,404 @@
+import datetime
+import functools
+import json
+import re
+import threading
+import urllib.parse
+import xmlrpc.server
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn
+import pandas as pd
+import pyarrow as pa
+
+# Local replacements for every remote service the library talks to. They run in-process,
+# bind to 127.0.0.1 on a free port and count the work they serve, so benchmarks and tests
+# can exercise the real request/marshalling code without credentials or network.
+
+class _Handler(BaseHTTPRequestHandler):
+
+  protocol_version = 'HTTP/1.1'
+
+  def _dispatch(self, method):
+
+    parsed = urllib.parse.urlsplit(self.path)
+    query = dict(urllib.parse.parse_qsl(parsed.query, keep_blank_values = True))
+    length = int(self.headers.get('Content-Length') or 0)
+    body = self.rfile.read(length) if length else b''
+
+    server = self.server.standin
+    server.requests += 1
+
+    for route_method, pattern, handler in server.routes:
+      match = pattern.fullmatch(parsed.path)
+      if route_method == method and match:
+        status, payload = handler(query, body, **match.groupdict())
+        break
+    else:
+      status, payload = 404, {'message': f'no route for {method} {parsed.path}'}
+
+    content = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+    server.bytes_sent += len(content)
+
+    self.send_response(status)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(content)))
+    self.end_headers()
+    self.wfile.write(content)
+
+  def do_GET(self):
+    self._dispatch('GET')
+
+  def do_POST(self):
+    self._dispatch('POST')
+
+  def log_message(self, *args):
+    pass
+
+class LocalHTTPServer:
+
+  """
+  Threaded JSON HTTP server with regex routes
+
+  routes: list of (method, path_regex, handler). handler(query, body, **groups) returns (status, dict or bytes)
+  """
+
+  def __init__(self, routes):
+
+    self.routes = [(method, re.compile(pattern), handler) for method, pattern, handler in routes]
+    self.requests = 0
+    self.bytes_sent = 0
+    self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    self._httpd.daemon_threads = True
+    self._httpd.standin = self
+    self._thread = threading.Thread(target = self._httpd.serve_forever, daemon = True)
+
+  @property
+  def url(self):
+    host, port = self._httpd.server_address
+    return f'http://{host}:{port}'
+
+  def __enter__(self):
+    self._thread.start()
+    return self
+
+  def __exit__(self, *exc):
+    self._httpd.shutdown()
+    self._httpd.server_close()
+
+def hubspot_routes(objects, page_size = 100):
+
+  """
+  Routes that serve the legacy recently-modified endpoints with offset pagination
+
+  objects: list output of generators.hubspot_objects
+  page_size: int default page size when 'count' is not sent
+
+  return: list of routes for LocalHTTPServer
+  """
+
+  def recent_modified(query, body, object_type):
+    offset = int(query.get('offset', 0))
+    count = int(query.get('count', page_size))
+    end = offset + count
+    return 200, {'results': objects[offset:end], 'hasMore': end < len(objects), 'offset': end, 'total': len(objects)}
+
+  return [('GET', r'/(?P<object_type>deals|companies|engagements)/v1/.*/recent/modified', recent_modified)]
+
+def hubspot_search_routes(objects, result_cap = 10000):
+
+  """
+  Routes that serve the CRM v3 search endpoint with GTE/LT filters on a datetime property and 'after' paging
+
+  objects: list output of generators.hubspot_search_objects
+  result_cap: int max objects one query can page through, like the real API
+
+  return: list of routes for LocalHTTPServer
+  """
+
+  @functools.lru_cache(maxsize = None)
+  def epoch_ms(value):
+    return round(datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%fZ').replace(tzinfo = datetime.timezone.utc).timestamp() * 1000)
+
+  def search(query, body, object_type):
+    request = json.loads(body)
+    selected = objects
+    for f in request.get('filterGroups', [{}])[0].get('filters', []):
+      value = int(f['value'])
+      if f['operator'] == 'GTE':
+        selected = [o for o in selected if epoch_ms(o['properties'][f['propertyName']]) >= value]
+      elif f['operator'] == 'LT':
+        selected = [o for o in selected if epoch_ms(o['properties'][f['propertyName']]) < value]
+    for sort in request.get('sorts', []):
+      selected = sorted(selected, key = lambda o: o['properties'][sort['propertyName']], reverse = sort['direction'] == 'DESCENDING')
+
+    after = int(request.get('after', 0))
+    if after >= result_cap:
+      return 400, {'status': 'error', 'message': 'paging beyond the result cap'}
+    end = min(after + request.get('limit', 10), len(selected), result_cap)
+    keep = set(request.get('properties', [])) | {'hs_object_id', 'createdate', 'hs_lastmodifieddate'}
+    results = [{**o, 'properties': {k: v for k, v in o['properties'].items() if k in keep}} for o in selected[after:end]]
+    response = {'total': len(selected), 'results': results}
+    if end < min(len(selected), result_cap):
+      response['paging'] = {'next': {'after': str(end)}}
+    return 200, response
+
+  return [('POST', r'/crm/v3/objects/(?P<object_type>\w+)/search', search)]
+
+def graph_routes(media, insights_fun, user_insights = None):
+
+  """
+  Routes that serve the Graph API edges used by the instagram module
+
+  media: dict output of generators.graph_media
+  insights_fun: callable(media_id) returning the media insights payload
+  user_insights: dict output of generators.graph_user_insights
+
+  return: list of routes for LocalHTTPServer
+  """
+
+  def media_insights(query, body, media_id):
+    return 200, insights_fun(media_id)
+
+  def account_insights(query, body, account_id):
+    return 200, user_insights
+
+  def account_media(query, body, account_id):
+    return 200, media
+
+  return [
+    ('GET', r'/(?P<media_id>\d{17,})/insights', media_insights),
+    ('GET', r'/(?P<account_id>[^/]+)/insights', account_insights),
+    ('GET', r'/(?P<account_id>[^/]+)/media', account_media)
+    ]
+
+def _odoo_match(record, domain):
+
+  for field, operator, value in domain:
+    current = record.get(field)
+    if operator == '>' and not current > value:
+      return False
+    if operator == '>=' and not current >= value:
+      return False
+    if operator == '<' and not current < value:
+      return False
+    if operator == '=' and not current == value:
+      return False
+    if operator == 'in' and current not in value:
+      return False
+
+  return True
+
+class OdooStandin:
+
+  """
+  In-memory Odoo 'object' service implementing execute_kw for search, search_read and search_count
+
+  records: dict model_name -> list of records, as generators.odoo_* return them
+  """
+
+  def __init__(self, records):
+
+    self.records = records
+    self.calls = 0
+
+  def execute_kw(self, db, uid, password, model, method, args, kwargs = None):
+
+    self.calls += 1
+    kwargs = kwargs or {}
+    domain = [tuple(d) for d in (args[0] if args else [])]
+    # Odoo domains use '-' or '/' separated datetimes indistinctly
+    domain = [(f, o, v.replace('/', '-') if isinstance(v, str) else v) for f, o, v in domain]
+    selected = [r for r in self.records.get(model, []) if _odoo_match(r, domain)]
+
+    if kwargs.get('order', '').startswith('id'):
+      selected = sorted(selected, key = lambda r: r['id'])
+
+    offset = kwargs.get('offset', 0)
+    limit = kwargs.get('limit')
+    selected = selected[offset:offset + limit] if limit else selected[offset:]
+
+    if method == 'search':
+      return [r['id'] for r in selected]
+    if method == 'search_count':
+      return len(selected)
+    if method == 'search_read':
+      fields = kwargs.get('fields')
+      if fields:
+        keep = set(fields) | {'id'}
+        return [{k: v for k, v in r.items() if k in keep} for r in selected]
+      return selected
+
+    raise ValueError(f'unsupported method {method}')
+
+def odoo_jsonrpc_routes(odoo):
+
+  """
+  Routes that serve an OdooStandin at /jsonrpc, the way Odoo dispatches the 'common' and 'object' services
+
+  odoo: OdooStandin
+
+  return: list of routes for LocalHTTPServer
+  """
+
+  def jsonrpc(query, body):
+    request = json.loads(body)
+    params = request['params']
+    try:
+      if params['service'] == 'common':
+        result = 2
+      else:
+        result = odoo.execute_kw(*params['args'])
+    except Exception as e:
+      return 200, {'jsonrpc': '2.0', 'id': request['id'], 'error': {'code': 200, 'message': 'Odoo Server Error', 'data': {'name': type(e).__name__, 'message': str(e)}}}
+    return 200, {'jsonrpc': '2.0', 'id': request['id'], 'result': result}
+
+  return [('POST', r'/jsonrpc', jsonrpc)]
+
+class _ThreadedXMLRPCServer(ThreadingMixIn, xmlrpc.server.SimpleXMLRPCServer):
+  daemon_threads = True
+
+class _OdooRequestHandler(xmlrpc.server.SimpleXMLRPCRequestHandler):
+  rpc_paths = ('/xmlrpc/2/object', '/xmlrpc/2/common')
+
+class LocalXmlRpcServer:
+
+  """
+  XML-RPC server exposing an OdooStandin at /xmlrpc/2/object
+
+  records: dict model_name -> list of records
+  """
+
+  def __init__(self, records):
+
+    self.odoo = OdooStandin(records)
+    self._server = _ThreadedXMLRPCServer(('127.0.0.1', 0), requestHandler = _OdooRequestHandler, logRequests = False, allow_none = True)
+    self._server.register_function(self.odoo.execute_kw, 'execute_kw')
+    self._server.register_function(lambda db, login, password, env: 2, 'authenticate')
+    self._thread = threading.Thread(target = self._server.serve_forever, daemon = True)
+
+  @property
+  def url(self):
+    host, port = self._server.server_address
+    return f'http://{host}:{port}'
+
+  def __enter__(self):
+    self._thread.start()
+    return self
+
+  def __exit__(self, *exc):
+    self._server.shutdown()
+    self._server.server_close()
+
+class _QueryJob:
+
+  def __init__(self, df = None):
+    self._df = df if df is not None else pd.DataFrame()
+
+  def result(self):
+    return self
+
+  def to_dataframe(self):
+    return self._df
+
+class _LoadJob:
+
+  def __init__(self, table):
+    self.output_rows = table.num_rows
+
+  def result(self):
+    return self
+
+class FakeBigQueryClient:
+
+  """
+  Minimal in-memory stand-in for google.cloud.bigquery.Client
+
+  Understands the statements the bigquery module sends: SELECT max/min(field) AS last_updated,
+  DELETE ... WHERE field in (...) and plain SELECT columns FROM table [WHERE field in (...)].
+  Loaded frames are converted to Arrow, like the real client does before uploading.
+  """
+
+  _select_agg = re.compile(r"SELECT\s+(?P<agg>max|min)\((?P<field>\w+)\)\s+as\s+last_updated\s+FROM\s+`(?P<table>[^`]+)`", re.I)
+  _delete = re.compile(r"DELETE\s+`(?P<table>[^`]+)`\s+WHERE\s+(?P<field>\w+)\s+in\s+\((?P<ids>.*)\)", re.I | re.S)
+  _select = re.compile(r"SELECT\s+(?P<columns>[\w\s,*]+?)\s+FROM\s+`(?P<table>[^`]+)`(\s+WHERE\s+(?P<field>\w+)\s+in\s+\((?P<ids>.*)\))?", re.I | re.S)
+
+  def __init__(self, tables = None):
+
+    self.tables = dict(tables or {})
+    self.queries = []
+    self.loads = []
+    self.rows_loaded = 0
+    self.rows_deleted = 0
+    self._lock = threading.Lock()
+
+  def query(self, query, project = None, job_config = None):
+
+    with self._lock:
+      self.queries.append(query)
+
+      match = self._select_agg.search(query)
+      if match:
+        if match['table'] not in self.tables:
+          # The real client raises NotFound for checkpoint queries on tables that were never loaded
+          from google.api_core.exceptions import NotFound
+          raise NotFound(f"Not found: Table {match['table']}")
+        df = self.tables[match['table']]
+        column = df[match['field']] if match['field'] in df else pd.Series(dtype = object)
+        value = getattr(column, match['agg'])() if not column.empty else None
+        return _QueryJob(pd.DataFrame({'last_updated': [value]}))
+
+      match = self._delete.search(query)
+      if match:
+        table = match['table']
+        df = self.tables.get(table)
+        if df is not None and not df.empty:
+          ids = set(json.loads('[' + match['ids'] + ']'))
+          keep = ~df[match['field']].astype(str).isin(ids)
+          self.rows_deleted += int((~keep).sum())
+          self.tables[table] = df[keep].reset_index(drop = True)
+        return _QueryJob()
+
+      match = self._select.search(query)
+      if match:
+        df = self.tables.get(match['table'], pd.DataFrame())
+        if match['ids'] is not None and not df.empty:
+          ids = set(json.loads('[' + match['ids'] + ']'))
+          df = df[df[match['field']].astype(str).isin(ids)]
+        columns = [c.strip() for c in match['columns'].split(',')]
+        if columns != ['*']:
+          df = df.reindex(columns = columns)
+        return _QueryJob(df.reset_index(drop = True))
+
+    raise ValueError(f'FakeBigQueryClient does not understand: {query}')
+
+  def load_table_from_dataframe(self, dataframe, destination, job_config = None):
+
+    table = pa.Table.from_pandas(dataframe, preserve_index = False)
+
+    with self._lock:
+      self.loads.append((destination, table.num_rows, job_config))
+      self.rows_loaded += table.num_rows
+      current = self.tables.get(destination)
+      loaded = table.to_pandas()
+      self.tables[destination] = loaded if current is None or current.empty else pd.concat([current, loaded], ignore_index = True)
+
+    return _LoadJob(table)
+
+class FakeFulcrumClient:
+
+  """
+  Stand-in for fulcrum.Fulcrum exposing query()
+
+  rows: dict output of generators.fulcrum_rows
+  """
+
+  def __init__(self, rows):
+
+    self.rows = rows
+    self.queries = []
+
+  def query(self, sql, format = 'json'):
+
+    self.queries.append(sql)
+
+    return self.rows
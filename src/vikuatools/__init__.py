@@ -1,3 +1,22 @@
-# read version from installed package
-from importlib.metadata import version
-__version__ = version("vikuatools")
\ No newline at end of file
+# Submodules and __version__ load on first attribute access (PEP 562), so `import vikuatools`
+# does not pull pandas, requests or google-cloud-bigquery into short-lived jobs that never use them
+import importlib
+
+_SUBMODULES = ['bigquery', 'fulcrum', 'hubspot', 'instagram', 'instrument', 'odoo', 'parallel', 'runner', 'schema', 'spill', 'utils']
+
+def __getattr__(name):
+  
+  if name in _SUBMODULES:
+    return importlib.import_module(f'{__name__}.{name}')
+  
+  if name == '__version__':
+    # read version from installed package
+    from importlib.metadata import version
+    globals()['__version__'] = version('vikuatools')
+    return globals()['__version__']
+  
+  raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+def __dir__():
+  
+  return sorted(list(globals()) + _SUBMODULES + ['__version__'])
@@ -1,6 +1,18 @@
+import os
+import logging
+from functools import partial
+import numpy as np
 import pandas as pd
-from google.cloud import bigquery
+from vikuatools.instrument import stage, instrumented
+from vikuatools.utils import hash_rows, int_to_string
+from vikuatools.schema import get_schema
 
+logger = logging.getLogger(__name__)
+
+# Modification timestamps sources bump on writes that do not change any extracted value, left out of row fingerprints by default
+MODIFIED_COLUMNS = ['write_date', 'hs_lastmodifieddate', 'lastmodifieddate', 'updatedAt', '_server_updated_at']
+
+@instrumented('checkpoint', source = 'bigquery')
 def bq_get_last_updated_object(bq_client, project_name, dataset_name, table_name, field_name, order = 'max'):
   
   """
@@ -51,7 +63,7 @@ def drop_duplicates(bq_client, table_id, field_name, ids):
     
   return query_job.result()
 
-def load_table_from_dataframe_safely(bq_client, df: pd.DataFrame, table_id: str, job_config = None, drop_id_field = None):
+def load_table_from_dataframe_safely(bq_client, df: pd.DataFrame, table_id: str, job_config = None, drop_id_field = None, hash_index = None, hash_columns = None, exclude_columns = None, schema = None):
   
   """
   Load table to BQ avoiding error if df is empty. Could be drop ids to avoid duplicates if drop_id_field is set.
@@ -62,21 +74,231 @@ def load_table_from_dataframe_safely(bq_client, df: pd.DataFrame, table_id: str,
   table_id: id of table in BigQuery, it should consist of project.dataset.table
   job_config: bigquery.LoadJobConfig definitions
   drop_id_field: name of the field to drop in table_id to avoid duplicates
+  hash_index: LocalHashIndex or BigQueryHashIndex. If set together with drop_id_field, rows whose content did not change
+    since the last load are skipped before the delete and load, and the index is updated after a successful load
+  hash_columns: list of columns to fingerprint, default all columns
+  exclude_columns: list of columns left out of the fingerprint, default MODIFIED_COLUMNS. Rows where only these
+    changed are skipped, so the table keeps their previous value. If the table max(write_date), the checkpoint
+    of bq_get_last_updated_object, is older than the newest skipped row, that row is loaded anyway so the
+    checkpoint still moves past the skipped rows
+  schema: vikuatools.schema.TableSchema or name of a registered one. df is cast to its dtypes and, if job_config
+    is not set, loaded with its cached LoadJobConfig instead of schema autodetection
     
   return: nothing, it uploads the df to BQ in the table_id destination
   """
+  
+  if schema is not None:
+    schema = get_schema(schema)
+    df = schema.cast(df)
+    job_config = job_config or schema.job_config()
+  
+  hashes = None
+  if hash_index is not None and drop_id_field and not df.empty:
+    df, hashes = drop_unchanged_rows(df, drop_id_field, hash_index, hash_columns, exclude_columns, partial(_last_modified, bq_client, table_id))
     
   if df.empty:
-    return(print(f'Empty Table, there are not new records in {table_id}'))
+    logger.info('Empty Table, there are not new records in %s', table_id)
+    return None
+  
+  with stage('load', source = 'bigquery', target = table_id) as record:
+    if drop_id_field:
+      drop_ids = list(df[drop_id_field])
+      drop_duplicates(bq_client, table_id = table_id, field_name =  drop_id_field, ids = drop_ids)
+      record.add_request()
+    
+    if job_config:
+      job = bq_client.load_table_from_dataframe(df, table_id, job_config=job_config)
+    
+    else:
+      job = bq_client.load_table_from_dataframe(df, table_id)
+    
+    result = job.result()
+    record.add_request()
+    record.rows = len(df)
+  
+  if hashes is not None:
+    hash_index.update(df[drop_id_field], hashes)
+    
+  return(result)
+
+def _last_modified(bq_client, table_id, column):
+  
+  from google.api_core.exceptions import NotFound
+  
+  try:
+    return bq_get_last_updated_object(bq_client, *table_id.split('.', 2), column)
+  except NotFound:
+    return None
+
+def drop_unchanged_rows(df, id_field, hash_index, hash_columns = None, exclude_columns = None, last_modified = None):
+  
+  """
+  Drop rows whose fingerprint equals the one stored in hash_index for the same id
+  
+  df: pd.DataFrame
+  id_field: name of the "primary_key" field
+  hash_index: LocalHashIndex or BigQueryHashIndex
+  hash_columns: list of columns to fingerprint, default all columns
+  exclude_columns: list of columns left out of the fingerprint, default MODIFIED_COLUMNS. For the ones in
+    MODIFIED_COLUMNS, the unchanged row with the newest value is kept if neither a changed row nor the table is as
+    new, so the table checkpoint keeps moving
+  last_modified: function column -> max value already loaded in the table, or None if unknown. Default unknown
+  
+  return: tuple with changed rows of df and their hashes
+  """
+  
+  exclude_columns = MODIFIED_COLUMNS if exclude_columns is None else exclude_columns
+  hashes = hash_rows(df, [c for c in (df.columns if hash_columns is None else hash_columns) if c not in exclude_columns])
+  ids = df[id_field].map(int_to_string) if df[id_field].dtype != object else df[id_field]
+  stored = hash_index.lookup(ids)
+  
+  # Positional lookup keeps the comparison in uint64, a map/reindex would upcast misses to float
+  position = stored.index.get_indexer(ids)
+  found = position >= 0
+  unchanged = np.zeros(len(df), dtype = bool)
+  unchanged[found] = stored.to_numpy()[position[found]] == hashes.to_numpy()[found]
+  
+  
+  for column in [c for c in MODIFIED_COLUMNS if c in exclude_columns and c in df]:
+    modified = df[column].reset_index(drop = True)
+    newest_skipped = modified[unchanged].max()
+    if pd.isna(newest_skipped) or modified[~unchanged].max() >= newest_skipped:
+      continue
+    loaded = last_modified(column) if last_modified is not None else None
+    try:
+      behind = pd.isna(loaded) or loaded < newest_skipped
+    except TypeError:
+      behind = True
+    if behind:
+      unchanged[modified[unchanged].idxmax()] = False
+  if unchanged.any():
+    logger.info('%s unchanged rows skipped', int(unchanged.sum()))
+  
+  return df[~unchanged], hashes[~unchanged]
+
+class LocalHashIndex:
+  
+  """
+  Row fingerprints keyed by id, stored in a local parquet file
+  
+  path: str parquet file, created on first update
+  """
+  
+  def __init__(self, path):
+    
+    self.path = path
+    self._hashes = None
+  
+  def _load(self):
+    
+    if self._hashes is None:
+      try:
+        index_df = pd.read_parquet(self.path)
+        self._hashes = pd.Series(index_df['row_hash'].to_numpy(), index = index_df['id'].to_numpy())
+      except FileNotFoundError:
+        self._hashes = pd.Series(dtype = 'uint64')
+    
+    return self._hashes
   
-  if drop_id_field:
-    drop_ids = list(df[drop_id_field])
-    drop_duplicates(bq_client, table_id = table_id, field_name =  drop_id_field, ids = drop_ids)
+  def lookup(self, ids):
+    
+    """
+    ids: iterable of str ids
+    
+    return: pd.Series with stored uint64 hashes indexed by id. The local index is small, it returns every known id
+    """
+    
+    return self._load()
+  
+  def update(self, ids, hashes):
+    
+    """
+    ids: iterable of str ids
+    hashes: iterable of uint64 hashes, output of hash_rows
+    """
+    
+    ids = [int_to_string(x) if not isinstance(x, str) else x for x in ids]
+    new = pd.Series(pd.Series(hashes).to_numpy(dtype = 'uint64'), index = ids)
+    current = self._load()
+    
+    merged = pd.concat([current[~current.index.isin(new.index)], new[~new.index.duplicated(keep = 'last')]])
+    pd.DataFrame({'id': merged.index.astype(str), 'row_hash': merged.to_numpy(dtype = 'uint64')}).to_parquet(self.path + '.tmp', index = False)
+    os.replace(self.path + '.tmp', self.path)
+    self._hashes = merged
+
+class BigQueryHashIndex:
+  
+  """
+  Row fingerprints keyed by id, stored in a BigQuery table with columns id STRING and row_hash INT64
   
-  if job_config:
-    job = bq_client.load_table_from_dataframe(df, table_id, job_config=job_config)
+  bq_client: BigQuery Client
+  table_id: id of the index table, it should consist of project.dataset.table
+  batch_size: int ids per lookup query
+  """
+  
+  def __init__(self, bq_client, table_id, batch_size = 10000):
+    
+    self.bq_client = bq_client
+    self.table_id = table_id
+    self.batch_size = batch_size
   
-  else:
-    job = bq_client.load_table_from_dataframe(df, table_id)
+  def lookup(self, ids):
     
-  return(job.result())
+    ids = list(dict.fromkeys(ids))
+    found = []
+    for i in range(0, len(ids), self.batch_size):
+      collapsed_ids = ', '.join('"' + x + '"' for x in ids[i:i + self.batch_size])
+      query = f"""SELECT id, row_hash FROM `{self.table_id}` WHERE id in ({collapsed_ids})"""
+      found.append(self.bq_client.query(query).result().to_dataframe())
+    
+    if not found:
+      return pd.Series(dtype = 'uint64')
+    
+    index_df = pd.concat(found, ignore_index = True).drop_duplicates('id', keep = 'last')
+    
+    # INT64 in BigQuery, reinterpret as the unsigned hash
+    return pd.Series(index_df['row_hash'].to_numpy(dtype = 'int64').view('uint64'), index = index_df['id'].to_numpy())
+  
+  def update(self, ids, hashes):
+    
+    ids = [int_to_string(x) if not isinstance(x, str) else x for x in ids]
+    index_df = pd.DataFrame({'id': ids, 'row_hash': pd.Series(hashes).to_numpy(dtype = 'uint64').view('int64')})
+    index_df = index_df.drop_duplicates('id', keep = 'last')
+    
+    # Batched like lookup, a single DELETE for a backfill would go over the query length limit
+    ids = list(index_df['id'])
+    for i in range(0, len(ids), self.batch_size):
+      drop_duplicates(self.bq_client, table_id = self.table_id, field_name = 'id', ids = ids[i:i + self.batch_size])
+    self.bq_client.load_table_from_dataframe(index_df, self.table_id).result()
+
+def load_frames_safely(bq_client, frames, table_id: str, job_config = None, drop_id_field = None, schema = None):
+  
+  """
+  Load an iterable of dataframes to BQ one by one with load_table_from_dataframe_safely, e.g. the output of
+  vikuatools.spill.clean_segments, so only one cleaned chunk is in memory at a time
+  
+  bq_client: BigQuery Client
+  frames: iterable of pd.DataFrame
+  table_id: id of table in BigQuery, it should consist of project.dataset.table
+  job_config: bigquery.LoadJobConfig definitions
+  drop_id_field: name of the field to drop in table_id to avoid duplicates
+  schema: vikuatools.schema.TableSchema or name of a registered one
+  
+  return: int number of rows loaded
+  """
+  
+  n_rows = 0
+  for df in frames:
+    load_table_from_dataframe_safely(bq_client, df, table_id, job_config = job_config, drop_id_field = drop_id_field, schema = schema)
+    n_rows += len(df)
+  
+  return n_rows
+
+def __getattr__(name):
+  
+  # google.cloud.bigquery takes longer to import than pandas and callers pass their own client, import it on first use
+  if name == 'bigquery':
+    from google.cloud import bigquery
+    return bigquery
+  
+  raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
@@ -1,6 +1,7 @@
-from fulcrum import Fulcrum
 import pandas as pd
+from vikuatools.instrument import instrumented
 
+@instrumented('fetch', source = 'fulcrum')
 def query_to_df(fulcrum_client, query):
   
   """
@@ -16,3 +17,12 @@ def query_to_df(fulcrum_client, query):
   response_df = pd.DataFrame(response_json['rows'])
 
   return response_df
+
+def __getattr__(name):
+  
+  # The fulcrum client is only needed by callers building one, import it on first use
+  if name == 'Fulcrum':
+    from fulcrum import Fulcrum
+    return Fulcrum
+  
+  raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
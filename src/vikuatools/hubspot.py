@@ -1,10 +1,20 @@
 import requests
 import json
+import logging
+import threading
+import time
 import urllib
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 import pandas as pd
-from vikuatools.utils import int_to_string, remove_value_from_dict_key, parse_properties
+from vikuatools.utils import int_to_string, remove_value_from_dict_key, parse_properties, decode_json
+from vikuatools.schema import TableSchema
+from vikuatools.instrument import stage, instrumented
+from vikuatools.spill import SpillDir
 
-def hs_get_recent_modified(url, parameters, max_results):
+logger = logging.getLogger(__name__)
+
+def hs_get_recent_modified(url, parameters, max_results, spill_dir = None, spill_format = 'ndjson'):
   
   """
   Get recent modified object from hubspot API legacy
@@ -12,8 +22,12 @@ def hs_get_recent_modified(url, parameters, max_results):
   url: str endpoint to retreive. one of deals, companies or engagements
   parameters: dict with parameters to include in call e.g. api_key, count, since
   max_results: dbl max number of objects to retreive
+  spill_dir: str working directory. If set, every page is written to a segment file instead of kept in memory,
+    and a previous interrupted call with the same spill_dir, url and parameters resumes from its last completed segment.
+    A spill_dir filled by a different request is reset
+  spill_format: str 'ndjson' or 'parquet' segment format
   
-  return: list with object from responses
+  return: list with object from responses, or vikuatools.spill.SpillDir if spill_dir is set
   """
   
   object_list = []
@@ -21,34 +35,60 @@ def hs_get_recent_modified(url, parameters, max_results):
   parameter_dict = parameters
   headers = {}
   
-  # Paginate your request using offset
-  has_more = True
-  while has_more:
-    params = urllib.parse.urlencode(parameter_dict)
-    get_url = get_recent_url + params
-    r = requests.get(url= get_url, headers = headers)
-    response_dict = json.loads(r.text)
-    
-    try:
-      has_more = response_dict['hasMore']
-    except KeyError:
-      has_more = response_dict['has-more']
-    
-    try:
-      object_list.extend(response_dict['results'])
-    except KeyError:
-      object_list.extend(response_dict['contacts'])
-    
-    try:
-      parameter_dict['offset'] = response_dict['offset']
-    except KeyError:
-      parameter_dict['vidOffset'] = response_dict['vid-offset']
+  spill = None
+  if spill_dir:
+    request = {'url': url, 'parameters': {k: v for k, v in parameters.items() if k not in ('offset', 'vidOffset')}}
+    spill = SpillDir(spill_dir, spill_format, request = request)
+    if spill.complete:
+      logger.info('Done!! Found %s object in %s', len(spill), spill_dir)
+      return spill
+    parameter_dict.update(spill.cursor)
+  
+  n_objects = len(spill) if spill is not None else 0
+  
+  with stage('fetch', source = 'hubspot', target = url) as record:
+    # Paginate your request using offset
+    has_more = True
+    while has_more:
+      params = urllib.parse.urlencode(parameter_dict)
+      get_url = get_recent_url + params
+      r = requests.get(url= get_url, headers = headers)
+      record.add_request(len(r.content))
+      response_dict = decode_json(r.content, fields = ['hasMore', 'has-more', 'results', 'contacts', 'offset', 'vid-offset'])
+      
+      try:
+        has_more = response_dict['hasMore']
+      except KeyError:
+        has_more = response_dict['has-more']
+      
+      try:
+        page = response_dict['results']
+      except KeyError:
+        page = response_dict['contacts']
+      
+      try:
+        cursor = {'offset': response_dict['offset']}
+      except KeyError:
+        cursor = {'vidOffset': response_dict['vid-offset']}
+      parameter_dict.update(cursor)
+      
+      n_objects += len(page)
+      if spill is not None:
+        spill.write_segment(page, cursor)
+      else:
+        object_list.extend(page)
+      
+      if n_objects >= max_results: # Exit pagination, based on whatever value you've set your max results variable to.
+        logger.warning('maximum number of results exceeded')
+        break
     
-    if len(object_list) >= max_results: # Exit pagination, based on whatever value you've set your max results variable to.
-      print('maximum number of results exceeded')
-      break
+    record.rows = n_objects
+  
+  logger.info('Done!! Found %s object', n_objects)
   
-  print(f'Done!! Found {len(object_list)} object')
+  if spill is not None:
+    spill.mark_complete()
+    return spill
   
   return object_list
 
@@ -74,31 +114,158 @@ def hs_get_recent_modified_contacts(url, hapikey, count, max_results, contact_pr
   properties_w_header = ['property='+x for x in contact_property]
   properties_url = '&'+'&'.join(properties_w_header)
   
-  # Paginate your request using offset
-  has_more = True
-  while has_more:
-    parameters = urllib.parse.urlencode(parameter_dict)
-    get_url = get_recent_url + parameters + properties_url
+  with stage('fetch', source = 'hubspot', target = url) as record:
+    # Paginate your request using offset
+    has_more = True
+    while has_more:
+      parameters = urllib.parse.urlencode(parameter_dict)
+      get_url = get_recent_url + parameters + properties_url
+      
+      r = requests.get(url= get_url, headers = headers)
+      record.add_request(len(r.content))
+      response_dict = decode_json(r.content, fields = ['has-more', 'contacts', 'vid-offset'])
+      
+      has_more = response_dict['has-more']
+      object_list.extend(response_dict['contacts'])
+      parameter_dict['vidOffset'] = response_dict['vid-offset']
+      
+      if len(object_list) >= max_results: # Exit pagination, based on whatever value you've set your max results variable to.
+        logger.warning('maximum number of results exceeded')
+        break
     
-    r = requests.get(url= get_url, headers = headers)
-    response_dict = json.loads(r.text)
+    record.rows = len(object_list)
+  
+  logger.info('Done!! Found %s object', len(object_list))
+  
+  return object_list
+
+def hs_search_modified(object_type, token, since, until, properties, n_slices = 8, max_workers = 8, modified_property = 'hs_lastmodifieddate', page_size = 100, result_cap = 10000, base_url = 'https://api.hubapi.com'):
+  
+  """
+  Get objects modified in [since, until) from the CRM v3 search API, splitting the window in time slices fetched concurrently.
+  A slice holding more objects than the search API can page through (result_cap) is split in two and fetched again.
+  Objects are deduplicated by id, keeping the most recent updatedAt
+  
+  object_type: str crm object e.g. deals, companies, contacts
+  token: str private app access token
+  since, until: datetime (naive values are UTC) or numeric epoch milliseconds
+  properties: list of properties to retreive
+  n_slices: int number of initial equal-width slices
+  max_workers: int number of concurrent requests
+  modified_property: str property to filter on. contacts use 'lastmodifieddate'
+  page_size: int objects per request, max 200 in the search API
+  result_cap: int max objects the search API returns for one query
+  base_url: str api root
+  
+  return: list with objects from responses, in CRM v3 format
+  """
+  
+  since_ms, until_ms = _epoch_ms(since), _epoch_ms(until)
+  url = f'{base_url}/crm/v3/objects/{object_type}/search'
+  headers = {'Authorization': f'Bearer {token}', 'Content-Type': 'application/json'}
+  sessions = threading.local()
+  
+  def fetch_slice(start, end):
+    if not hasattr(sessions, 'session'):
+      sessions.session = requests.Session()
+    return _hs_search_slice(sessions.session, url, headers, start, end, properties, modified_property, page_size, result_cap)
+  
+  step = max((until_ms - since_ms) // max(n_slices, 1), 1)
+  bounds = list(range(since_ms, until_ms, step)) + [until_ms]
+  
+  objects = {}
+  with stage('fetch', source = 'hubspot', target = url) as record:
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+      pending = {executor.submit(fetch_slice, start, end): (start, end) for start, end in zip(bounds[:-1], bounds[1:])}
+      
+      while pending:
+        done, _ = wait(pending, return_when = FIRST_COMPLETED)
+        for future in done:
+          start, end = pending.pop(future)
+          results, n_requests, n_bytes, split = future.result()
+          record.add_request(n_bytes, count = n_requests)
+          
+          if split:
+            middle = (start + end) // 2
+            for sub_start, sub_end in [(start, middle), (middle, end)]:
+              pending[executor.submit(fetch_slice, sub_start, sub_end)] = (sub_start, sub_end)
+            continue
+          
+          for obj in results:
+            current = objects.get(obj['id'])
+            if current is None or obj.get('updatedAt', '') >= current.get('updatedAt', ''):
+              objects[obj['id']] = obj
     
-    has_more = response_dict['has-more']
-    object_list.extend(response_dict['contacts'])
-    parameter_dict['vidOffset'] = response_dict['vid-offset']
+    record.rows = len(objects)
+  
+  logger.info('Done!! Found %s object', len(objects))
+  
+  return list(objects.values())
+
+def _epoch_ms(x):
+  
+  if isinstance(x, dt.datetime):
+    # naive datetimes are UTC, like everywhere else in the package, not host local time
+    if x.tzinfo is None:
+      x = x.replace(tzinfo = dt.timezone.utc)
+    return round(x.timestamp() * 1000)
+  
+  return int(x)
+
+def _hs_search_slice(session, url, headers, start, end, properties, modified_property, page_size, result_cap):
+  
+  body = {
+    'filterGroups': [{'filters': [
+      {'propertyName': modified_property, 'operator': 'GTE', 'value': str(start)},
+      {'propertyName': modified_property, 'operator': 'LT', 'value': str(end)}
+      ]}],
+    'sorts': [{'propertyName': modified_property, 'direction': 'ASCENDING'}],
+    'properties': properties,
+    'limit': page_size
+    }
+  
+  results = []
+  n_requests = n_bytes = 0
+  while True:
+    r = _hs_post(session, url, headers, body)
+    n_requests += 1
+    n_bytes += len(r.content)
+    response_dict = decode_json(r.content, fields = ['total', 'results', 'paging'])
     
-    if len(object_list) >= max_results: # Exit pagination, based on whatever value you've set your max results variable to.
-      print('maximum number of results exceeded')
+    # Too many objects to page through, ask for a split unless the slice is already a single millisecond
+    if n_requests == 1 and response_dict.get('total', 0) > result_cap and end - start > 1:
+      return [], n_requests, n_bytes, True
+    
+    results.extend(response_dict['results'])
+    after = response_dict.get('paging', {}).get('next', {}).get('after')
+    if after is None or len(results) >= result_cap:
       break
+    body['after'] = after
   
-  print(f'Done!! Found {len(object_list)} object')
+  if response_dict.get('total', 0) > result_cap:
+    logger.warning('%s objects modified at %s, only %s retreived', response_dict['total'], start, len(results))
   
-  return object_list
+  return results, n_requests, n_bytes, False
 
+def _hs_post(session, url, headers, body, retries = 5):
+  
+  for attempt in range(retries + 1):
+    r = session.post(url, data = json.dumps(body), headers = headers)
+    if r.status_code != 429 and r.status_code < 500 or attempt == retries:
+      break
+    # Rate limited or server error: wait what the API asks for, or back off exponentially
+    time.sleep(float(r.headers.get('Retry-After', 2 ** attempt)))
+  
+  r.raise_for_status()
+  
+  return r
+
+@instrumented('extract', source = 'hubspot')
 def hs_extract_value(new_objects, property_names):
   
   """
-  Extract insterested properties from api call response. If response has association, it will extract company and vids
+  Extract insterested properties from api call response. If response has association, it will extract company and vids.
+  Works with legacy objects ({'value': ...} per property) and CRM v3 objects (plain property values)
   
   new_objects: list with http response
   property_names: list with property names to keep
@@ -107,7 +274,10 @@ def hs_extract_value(new_objects, property_names):
   """
   
   # Association Flag
-  has_associations = 'associations' in new_objects[0].keys()
+  has_associations = 'associations' in new_objects[0].keys() and 'associatedVids' in new_objects[0]['associations']
+  
+  # Legacy Flag
+  is_legacy = isinstance(next(iter(new_objects[0]['properties'].values()), None), dict)
   
   # If exist, append association properties to element to keep
   if has_associations:
@@ -124,9 +294,12 @@ def hs_extract_value(new_objects, property_names):
     
     # Extract all property values
     props = obj['properties']
-    saved_properties = {}
-    for key, value in props.items():
-      saved_properties[key] = value['value']
+    if is_legacy:
+      saved_properties = {}
+      for key, value in props.items():
+        saved_properties[key] = value['value']
+    else:
+      saved_properties = dict(props)
     
     # If exist, append associations properties
     if has_associations:
@@ -145,6 +318,7 @@ def hs_extract_value(new_objects, property_names):
     
   return df_properties
 
+@instrumented('extract', source = 'hubspot')
 def hs_extract_engagements(engagement_list, *arg):
   
   """
@@ -179,23 +353,27 @@ def hs_extract_engagements(engagement_list, *arg):
   
   return df_eng
 
+@instrumented('clean', source = 'hubspot')
 def clean_hubspot_response(response_list, properties, parse_column, extraction_fun):
   
   """
   response_list: list with http response
   properties: list of properties names to query
-  parse_column: dictionary with columns to parse with 'parse_properties'
+  parse_column: dictionary with columns to parse with 'parse_properties', or a schema.TableSchema to use its parse plan
   extraction_fun: funtion to extract properties and association one of hs_extract_value or hs_extract_engagements
   
   return: pd.DataFrame with necessary columns and correct types
   """
   
   if not response_list:
-    print('Empty response')
+    logger.info('Empty response')
     return pd.DataFrame()
   
   response_df = extraction_fun(response_list, properties)
   
+  if isinstance(parse_column, TableSchema):
+    parse_column = parse_column.parse_plan()
+  
   if properties:
     values_to_rm_ = [x for x in properties if x not in response_df.columns]
     remove_value_from_dict_key(parse_column, values_to_rm_)
@@ -224,8 +402,10 @@ def get_mkt_email_stats(parameters):
   # endp = f'https://api.hubapi.com/marketing-emails/v1/emails/with-statistics?hapikey={hapikey}&limit={limit}&campaign=3086d92e-e66a-4b14-99f5-2b03523eb8ab'
   parameters_parsed = urllib.parse.urlencode(parameters)
   endp = 'https://api.hubapi.com/marketing-emails/v1/emails/with-statistics?' + parameters_parsed
-  r = requests.get(url=endp)
-  response_dict = json.loads(r.text)
+  with stage('fetch', source = 'hubspot', target = 'marketing-emails') as record:
+    r = requests.get(url=endp)
+    record.add_request(len(r.content))
+    response_dict = decode_json(r.content, fields = ['objects'])
   objects = response_dict['objects']
   
   campaign_df=pd.DataFrame(objects).query('currentState != "DRAFT"').reset_index(drop=True).dropna(subset='stats')
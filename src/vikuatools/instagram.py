@@ -1,7 +1,8 @@
 import requests
-import json
 import pandas as pd
 from functools import reduce
+from vikuatools.instrument import stage
+from vikuatools.utils import coerce_datetime, decode_json
 
 def ig_get(base_url, endpoint_parameters, to_df = True):
   
@@ -15,8 +16,10 @@ def ig_get(base_url, endpoint_parameters, to_df = True):
   return: list or df depending on 'to_df'
   """
   
-  req = requests.get(base_url, endpoint_parameters)
-  respond = json.loads(req.content)
+  with stage('fetch', source = 'instagram', target = base_url) as record:
+    req = requests.get(base_url, endpoint_parameters)
+    record.add_request(len(req.content))
+    respond = decode_json(req.content)
   
   if to_df:
     respond = pd.DataFrame(respond['data'])
@@ -37,18 +40,22 @@ def ig_media_insight(insight_list, endpoint_parameters, metrics = 'engagement,im
   """
   
   media_insight = []
-  # Loop Over 'Media ID'
-  for imedia in insight_list['data']:
-    # Define URL
-    url = endpoint_parameters['endpoint_base'] + imedia['id'] + '/insights'
-    # Define Endpoint Parameters
-    parameters_media = dict() 
-    parameters_media['metric'] = metrics
-    parameters_media['access_token'] = endpoint_parameters['access_token'] 
-    # Requests Data
-    media_data = requests.get(url, parameters_media )
-    json_media_data = json.loads(media_data.content)
-    media_insight.append(list(json_media_data['data']))
+  with stage('fetch', source = 'instagram', target = 'media_insights') as record:
+    # Loop Over 'Media ID'
+    for imedia in insight_list['data']:
+      # Define URL
+      url = endpoint_parameters['endpoint_base'] + imedia['id'] + '/insights'
+      # Define Endpoint Parameters
+      parameters_media = dict() 
+      parameters_media['metric'] = metrics
+      parameters_media['access_token'] = endpoint_parameters['access_token'] 
+      # Requests Data
+      media_data = requests.get(url, parameters_media )
+      record.add_request(len(media_data.content))
+      json_media_data = decode_json(media_data.content, fields = ['data'])
+      media_insight.append(list(json_media_data['data']))
+    
+    record.rows = len(media_insight)
   
   # Initialize Empty Container
   engagement_list = []
@@ -70,7 +77,7 @@ def ig_media_insight(insight_list, endpoint_parameters, metrics = 'engagement,im
   basic_insight_df = pd.DataFrame(insight_list['data'])
   insight_df = pd.concat([basic_insight_df, media_insight_df], axis=1)
   
-  insight_df['timestamp'] = insight_df['timestamp'].apply(pd.to_datetime)
+  insight_df['timestamp'] = coerce_datetime(insight_df['timestamp'], source = 'graph', utc = True)
   
   return insight_df
 
@@ -147,7 +154,6 @@ def ig_user_insight(endpoint_parameters, since = None, until = None):
   metric_df = reduce(lambda left,right: pd.merge(left,right,on='end_time'), metrics_list)
   
   # Convert to date
-  metric_df['end_time'] = metric_df['end_time'].apply(pd.to_datetime)
-  metric_df['end_time'] = metric_df['end_time'].apply(lambda x: x.date())
+  metric_df['end_time'] = coerce_datetime(metric_df['end_time'], source = 'graph', utc = True).dt.date
   
   return metric_df
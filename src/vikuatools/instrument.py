@@ -0,0 +1,371 @@
+import functools
+import json
+import logging
+import threading
+import time
+import tracemalloc
+
+# Per-stage instrumentation. Library functions wrap their fetch, extract, clean and load steps in
+# stage() or @instrumented; records are only built when at least one sink is registered, so the
+# disabled path is a single truthiness check.
+#
+# tracemalloc peaks are process wide, so peak_bytes is only recorded for stages that ran while no
+# stage was open in another thread. Stages overlapping across threads (runner jobs, hs_search_modified
+# slices) get peak_bytes None instead of a peak mixed with the other threads' allocations.
+
+logger = logging.getLogger(__name__)
+
+_sinks = []
+_trace_memory = False
+_started_tracing = False
+_local = threading.local()
+
+# thread ident -> {'overlapped': bool} of every thread with an open stage while tracing memory
+_memory_threads = {}
+_memory_lock = threading.Lock()
+
+class StageRecord:
+
+  """
+  Mutable measurements of one stage run. Stage code updates requests, bytes and rows while it runs
+  """
+
+  def __init__(self, stage, source = None, target = None):
+
+    self.stage = stage
+    self.source = source
+    self.target = target
+    self.started_at = time.time()
+    self.seconds = 0.0
+    self.requests = 0
+    self.bytes = 0
+    self.rows = None
+    self.peak_bytes = None
+    self.error = None
+
+  def add_request(self, nbytes = 0, count = 1):
+
+    self.requests += count
+    self.bytes += nbytes
+
+  def to_dict(self):
+
+    return {
+      'stage': self.stage,
+      'source': self.source,
+      'target': self.target,
+      'started_at': self.started_at,
+      'seconds': self.seconds,
+      'requests': self.requests,
+      'bytes': self.bytes,
+      'rows': self.rows,
+      'peak_bytes': self.peak_bytes,
+      'error': self.error
+      }
+
+class _NullRecord:
+
+  # Shared sink-less record: stage code can update it unconditionally at no cost
+
+  def add_request(self, nbytes = 0, count = 1):
+    pass
+
+  def __setattr__(self, name, value):
+    pass
+
+class _NullStage:
+
+  def __enter__(self):
+    return _NULL_RECORD
+
+  def __exit__(self, *exc):
+    return False
+
+_NULL_RECORD = _NullRecord()
+_NULL_STAGE = _NullStage()
+
+class _Stage:
+
+  def __init__(self, stage, source, target):
+
+    self.record = StageRecord(stage, source, target)
+
+  def __enter__(self):
+
+    stack = _local.__dict__.setdefault('stack', [])
+    if _trace_memory and tracemalloc.is_tracing():
+      if not stack:
+        _open_memory_thread()
+      memory = getattr(_local, 'memory', None)
+      if memory is not None and not memory['overlapped']:
+        _update_parent_peak(stack)
+        if hasattr(tracemalloc, 'reset_peak'):
+          tracemalloc.reset_peak()
+    stack.append(self.record)
+    self._start = time.perf_counter()
+
+    return self.record
+
+  def __exit__(self, exc_type, exc, tb):
+
+    record = self.record
+    record.seconds = time.perf_counter() - self._start
+    stack = _local.stack
+    stack.pop()
+
+    memory = getattr(_local, 'memory', None)
+    if memory is not None:
+      if _trace_memory and tracemalloc.is_tracing() and not memory['overlapped']:
+        record.peak_bytes = tracemalloc.get_traced_memory()[1]
+        _update_parent_peak(stack, record.peak_bytes)
+      if not stack:
+        _close_memory_thread()
+
+    if exc_type is not None:
+      record.error = exc_type.__name__
+
+    emit(record)
+
+    return False
+
+def _open_memory_thread():
+
+  # Called by the outermost stage of a thread, marks this thread and every thread with an open stage as overlapped
+
+  with _memory_lock:
+    _local.memory = {'overlapped': bool(_memory_threads)}
+    for other in _memory_threads.values():
+      other['overlapped'] = True
+    _memory_threads[threading.get_ident()] = _local.memory
+
+def _close_memory_thread():
+
+  with _memory_lock:
+    _memory_threads.pop(threading.get_ident(), None)
+  _local.memory = None
+
+def _update_parent_peak(stack, peak = None):
+
+  if not stack:
+    return
+
+  peak = tracemalloc.get_traced_memory()[1] if peak is None else peak
+  parent = stack[-1]
+  parent.peak_bytes = max(parent.peak_bytes or 0, peak)
+
+def stage(name, source = None, target = None):
+
+  """
+  Context manager measuring one stage. Yields a StageRecord to fill with requests, bytes and rows
+
+  name: str stage name, one of fetch, extract, clean, load or any other label
+  source: str system the stage talks to e.g. hubspot, odoo, bigquery
+  target: str object, model or table the stage works on
+
+  return: context manager
+  """
+
+  if not _sinks:
+    return _NULL_STAGE
+
+  return _Stage(name, source, target)
+
+def instrumented(name, source = None):
+
+  """
+  Decorator version of stage(). The target is the function name and rows are taken from len() of the result
+
+  name: str stage name
+  source: str system the stage talks to
+  """
+
+  def decorator(fun):
+
+    @functools.wraps(fun)
+    def wrapper(*args, **kwargs):
+
+      if not _sinks:
+        return fun(*args, **kwargs)
+
+      with _Stage(name, source, fun.__name__) as record:
+        result = fun(*args, **kwargs)
+        try:
+          record.rows = len(result)
+        except TypeError:
+          pass
+
+      return result
+
+    return wrapper
+
+  return decorator
+
+def emit(record):
+
+  """
+  Send a finished record to every registered sink. Sink failures are logged and never raised
+
+  record: StageRecord
+  """
+
+  data = record.to_dict()
+  for sink in list(_sinks):
+    try:
+      sink(data)
+    except Exception:
+      logger.exception('instrumentation sink %r failed', sink)
+
+def add_sink(sink, trace_memory = None):
+
+  """
+  Register a sink. Any callable receiving the record dict is a valid sink
+
+  sink: callable
+  trace_memory: bool start tracemalloc to record peak_bytes. It slows down allocation heavy code. Stages that
+    overlap with stages of other threads get peak_bytes None
+
+  return: sink, so it can be removed later
+  """
+
+  _sinks.append(sink)
+
+  if trace_memory is not None:
+    set_trace_memory(trace_memory)
+
+  return sink
+
+def remove_sink(sink):
+
+  if sink in _sinks:
+    _sinks.remove(sink)
+
+  if not _sinks:
+    set_trace_memory(False)
+
+def clear_sinks():
+
+  _sinks.clear()
+  set_trace_memory(False)
+
+def set_trace_memory(flag):
+
+  """
+  Turn peak memory tracking on or off. tracemalloc is only stopped if this module started it
+
+  flag: bool
+  """
+
+  global _trace_memory, _started_tracing
+
+  if flag and not tracemalloc.is_tracing():
+    tracemalloc.start()
+    _started_tracing = True
+  elif not flag and _started_tracing:
+    if tracemalloc.is_tracing():
+      tracemalloc.stop()
+    _started_tracing = False
+
+  _trace_memory = bool(flag)
+
+def enabled():
+
+  return bool(_sinks)
+
+class LoggingSink:
+
+  """
+  Write one log line per record
+
+  log: logging.Logger, default vikuatools.instrument
+  level: int logging level
+  """
+
+  def __init__(self, log = None, level = logging.INFO):
+
+    self.log = log or logger
+    self.level = level
+
+  def __call__(self, record):
+
+    self.log.log(
+      self.level,
+      '%s %s %s: %.3fs requests=%s bytes=%s rows=%s peak_bytes=%s%s',
+      record['stage'], record['source'], record['target'], record['seconds'], record['requests'],
+      record['bytes'], record['rows'], record['peak_bytes'], f" error={record['error']}" if record['error'] else ''
+      )
+
+class JsonLinesSink:
+
+  """
+  Append every record as one json line to path
+
+  path: str or path-like
+  """
+
+  def __init__(self, path):
+
+    self.path = path
+    self._lock = threading.Lock()
+
+  def __call__(self, record):
+
+    line = json.dumps(record, default = str) + '\n'
+    with self._lock:
+      with open(self.path, 'a') as f:
+        f.write(line)
+
+class MetricsRegistry:
+
+  """
+  In-memory registry of counters labelled by stage, source and target, rendered in Prometheus text format
+  """
+
+  COUNTERS = ['runs', 'errors', 'seconds', 'requests', 'bytes', 'rows']
+
+  def __init__(self, prefix = 'vikuatools_stage'):
+
+    self.prefix = prefix
+    self.counters = {}
+    self.peak_bytes = {}
+    self._lock = threading.Lock()
+
+  def __call__(self, record):
+
+    labels = (record['stage'], record['source'] or '', record['target'] or '')
+    with self._lock:
+      counters = self.counters.setdefault(labels, dict.fromkeys(self.COUNTERS, 0))
+      counters['runs'] += 1
+      counters['errors'] += 1 if record['error'] else 0
+      counters['seconds'] += record['seconds']
+      counters['requests'] += record['requests']
+      counters['bytes'] += record['bytes']
+      counters['rows'] += record['rows'] or 0
+      if record['peak_bytes'] is not None:
+        self.peak_bytes[labels] = max(self.peak_bytes.get(labels, 0), record['peak_bytes'])
+
+  def render(self):
+
+    """
+    return: str with the registry in Prometheus exposition format
+    """
+
+    lines = []
+    with self._lock:
+      for counter in self.COUNTERS:
+        name = f'{self.prefix}_{counter}_total'
+        lines.append(f'# TYPE {name} counter')
+        for labels, counters in self.counters.items():
+          lines.append(f'{name}{{{_render_labels(labels)}}} {counters[counter]}')
+      if self.peak_bytes:
+        name = f'{self.prefix}_peak_bytes'
+        lines.append(f'# TYPE {name} gauge')
+        for labels, value in self.peak_bytes.items():
+          lines.append(f'{name}{{{_render_labels(labels)}}} {value}')
+
+    return '\n'.join(lines) + '\n'
+
+def _render_labels(labels):
+
+  escaped = [str(v).replace('\\', '\\\\').replace('"', '\\"') for v in labels]
+
+  return ','.join(f'{k}="{v}"' for k, v in zip(['stage', 'source', 'target'], escaped))
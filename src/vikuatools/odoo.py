@@ -1,18 +1,119 @@
 import xmlrpc.client
+import hashlib
+import itertools
+import os
+import json
+import logging
+import requests
 import pandas as pd
-from vikuatools.utils import int_to_string, unlist_column
+from vikuatools.utils import int_to_string, unlist_column, coerce_datetime, decode_json
+from vikuatools.instrument import stage, instrumented
+from vikuatools.spill import SpillDir, read_segment, write_segment
 
-def get_odoo_model(odoo_model, db, uid, password, model_name, fields, checkpoint = '2000/01/01 00:00:00', extra_filters = None):
+logger = logging.getLogger(__name__)
+
+class XmlRpcTransport:
+  
+  """
+  Odoo external API over XML-RPC. Same interface as JsonRpcTransport, so get_odoo_model accepts either one
+  
+  url: str odoo server url e.g. https://mycompany.odoo.com
+  """
+  
+  def __init__(self, url):
+    
+    self.url = url.rstrip('/')
+    self.common = xmlrpc.client.ServerProxy(f'{self.url}/xmlrpc/2/common', allow_none = True)
+    self.models = xmlrpc.client.ServerProxy(f'{self.url}/xmlrpc/2/object', allow_none = True)
+  
+  def authenticate(self, db, username, password):
+    
+    return self.common.authenticate(db, username, password, {})
+  
+  def execute_kw(self, db, uid, password, model, method, args, kwargs = None):
+    
+    return self.models.execute_kw(db, uid, password, model, method, args, kwargs or {})
+
+class JsonRpcTransport:
+  
+  """
+  Odoo external API over the /jsonrpc endpoint, with a pooled keep-alive session and decode_json decoding.
+  Server errors are raised as xmlrpc.client.Fault, like the XML-RPC transport, so error handling does not change
+  
+  url: str odoo server url e.g. https://mycompany.odoo.com
+  pool_maxsize: int connections kept alive, one per thread calling concurrently
+  timeout: float seconds to wait for a response
+  """
+  
+  def __init__(self, url, pool_maxsize = 10, timeout = None):
+    
+    self.url = url.rstrip('/') + '/jsonrpc'
+    self.timeout = timeout
+    self.session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections = 1, pool_maxsize = pool_maxsize)
+    self.session.mount('http://', adapter)
+    self.session.mount('https://', adapter)
+    self._ids = itertools.count(1)
+  
+  def call(self, service, method, *args):
+    
+    payload = {'jsonrpc': '2.0', 'method': 'call', 'params': {'service': service, 'method': method, 'args': args}, 'id': next(self._ids)}
+    r = self.session.post(self.url, data = json.dumps(payload), headers = {'Content-Type': 'application/json'}, timeout = self.timeout)
+    r.raise_for_status()
+    response = decode_json(r.content, fields = ['result', 'error'])
+    
+    if response.get('error'):
+      error = response['error']
+      data = error.get('data') or {}
+      raise xmlrpc.client.Fault(error.get('code', 1), data.get('message') or error.get('message', ''))
+    
+    return response['result']
+  
+  def authenticate(self, db, username, password):
+    
+    return self.call('common', 'authenticate', db, username, password, {})
+  
+  def execute_kw(self, db, uid, password, model, method, args, kwargs = None):
+    
+    return self.call('object', 'execute_kw', db, uid, password, model, method, args, kwargs or {})
+
+def odoo_transport(url, protocol = 'xmlrpc', **kwargs):
+  
+  """
+  Build the object to pass as odoo_model to get_odoo_model
+  
+  url: str odoo server url
+  protocol: str 'xmlrpc' or 'jsonrpc'
+  kwargs: extra arguments for JsonRpcTransport
+  
+  return: XmlRpcTransport or JsonRpcTransport
+  """
+  
+  if protocol == 'xmlrpc':
+    return XmlRpcTransport(url)
+  
+  if protocol == 'jsonrpc':
+    return JsonRpcTransport(url, **kwargs)
+  
+  raise ValueError(f"protocol must be 'xmlrpc' or 'jsonrpc', got '{protocol}'")
+
+def get_odoo_model(odoo_model, db, uid, password, model_name, fields, checkpoint = '2000/01/01 00:00:00', extra_filters = None, spill_dir = None, spill_format = 'ndjson', page_size = 10000):
     
     """
-    odoo_model: model object returned from xmlrpc call
+    odoo_model: model object returned from xmlrpc call, or a transport from odoo_transport
     db, uid, password: str credentials
     model_name: str model name to query
     fields: fields to query
     checkpoint: str datetime to retreive records after. Format must be: %Y/%m/%d %H:%M:%S
     extra_filters: list difinning other filter to apply to the query
+    spill_dir: str working directory. If set, records are fetched in pages of page_size ordered by id and written
+      to segment files instead of kept in memory. An interrupted call with the same spill_dir resumes after the last completed page.
+      A spill_dir filled for another model, domain or fields is reset
+    spill_format: str 'ndjson' or 'parquet' segment format
+    page_size: int records per page when spill_dir is set
     
-    return: pd.df with the corresponding odoo model data
+    return: pd.df with the corresponding odoo model data, or vikuatools.spill.SpillDir if spill_dir is set.
+      Use records_to_df as 'prepare' function when cleaning the segments
     """
     
     call_filter = [['write_date', '>', checkpoint]]
@@ -20,19 +121,68 @@ def get_odoo_model(odoo_model, db, uid, password, model_name, fields, checkpoint
     if extra_filters:
       call_filter.append(extra_filters)
     
-    omodel = odoo_model.execute_kw(db, uid, password, model_name, 'search_read',
-      [call_filter],
-      {'fields': fields})
-    
-    model_df = pd.DataFrame(omodel)
+    if spill_dir:
+      return _spill_odoo_model(odoo_model, db, uid, password, model_name, fields, call_filter, spill_dir, spill_format, page_size)
     
-    if not model_df.empty:
-      model_df.loc[:, ('write_date')] = model_df.loc[:, ('write_date')].apply(pd.to_datetime)
+    with stage('fetch', source = 'odoo', target = model_name) as record:
+      omodel = odoo_model.execute_kw(db, uid, password, model_name, 'search_read',
+        [call_filter],
+        {'fields': fields})
+      record.add_request()
+      
+      model_df = records_to_df(omodel)
+      
+      record.rows = len(model_df)
     
-    print(f'{model_name} new records: {len(model_df)}')
+    logger.info('%s new records: %s', model_name, len(model_df))
     
     return(model_df)
 
+def _spill_odoo_model(odoo_model, db, uid, password, model_name, fields, call_filter, spill_dir, spill_format, page_size):
+    
+    request = {'db': db, 'model': model_name, 'domain': call_filter, 'fields': list(fields)}
+    spill = SpillDir(spill_dir, spill_format, request = request)
+    
+    with stage('fetch', source = 'odoo', target = model_name) as record:
+      # Keyset pagination on id keeps pages stable if records change while fetching
+      last_id = spill.cursor.get('last_id', 0)
+      while not spill.complete:
+        page = odoo_model.execute_kw(db, uid, password, model_name, 'search_read',
+          [call_filter + [['id', '>', last_id]]],
+          {'fields': fields, 'order': 'id', 'limit': page_size})
+        record.add_request()
+        
+        if page:
+          last_id = page[-1]['id']
+          spill.write_segment(page, {'last_id': last_id})
+        
+        if len(page) < page_size:
+          spill.mark_complete()
+      
+      record.rows = len(spill)
+    
+    logger.info('%s new records: %s', model_name, len(spill))
+    
+    return spill
+
+def records_to_df(records):
+  
+  """
+  Convert search_read records to pd.df parsing write_date
+  
+  records: list of dicts
+  
+  return: pd.df
+  """
+  
+  model_df = pd.DataFrame(records)
+  
+  if not model_df.empty:
+    model_df['write_date'] = coerce_datetime(model_df['write_date'], source = 'odoo')
+  
+  return model_df
+
+@instrumented('clean', source = 'odoo')
 def clean_move(df):
   
   """
@@ -49,11 +199,12 @@ def clean_move(df):
   df_copy = df.replace({False: None})
   
   df_copy['id'] = df_copy['id'].apply(int_to_string)
-  df_copy['invoice_date'] = df_copy['invoice_date'].apply(pd.to_datetime)
+  df_copy['invoice_date'] = coerce_datetime(df_copy['invoice_date'], source = 'odoo')
   
   
   return df_copy
 
+@instrumented('clean', source = 'odoo')
 def clean_move_line(df):
     
     """
@@ -87,7 +238,7 @@ def clean_move_line(df):
       move_line_df = move_line_df.drop(['account_description', 'tax_fiscal_country_id', 'partner_id', 'analytic_account_id'], axis = 'columns')
       
       # Convert Datetimes
-      move_line_df['date'] = move_line_df['date'].apply(pd.to_datetime)
+      move_line_df['date'] = coerce_datetime(move_line_df['date'], source = 'odoo')
       
       # Convert Integer to string
       int_to_str_columns = ['id', 'move_id', 'account_id', 'company_id', 'currency_id', 'journal_id']
@@ -99,6 +250,7 @@ def clean_move_line(df):
     
     return move_line_df
   
+@instrumented('clean', source = 'odoo')
 def clean_account(df):
   
   """
@@ -126,6 +278,7 @@ def clean_account(df):
   
   return df
 
+@instrumented('clean', source = 'odoo')
 def clean_analytic_tag(df):
   
   """
@@ -146,6 +299,7 @@ def clean_analytic_tag(df):
   
   return df
 
+@instrumented('clean', source = 'odoo')
 def clean_analytic_account(df):
   
   """
@@ -166,6 +320,7 @@ def clean_analytic_account(df):
   
   return df
 
+@instrumented('clean', source = 'odoo')
 def clean_currency_rate(df):
     
     """
@@ -187,7 +342,7 @@ def clean_currency_rate(df):
       currency_df = unlist_column(currency_df, 'currency_id', ['currency_id','currency_description'])
       
       # Convert Datetimes
-      currency_df['date'] = currency_df['name'].apply(pd.to_datetime)
+      currency_df['date'] = coerce_datetime(currency_df['name'], source = 'odoo')
       
       # Drop columns
       currency_df = currency_df.drop(['name'], axis = 'columns')
@@ -234,3 +389,138 @@ def split_column(df: pd.DataFrame, column_to_split: str, sep = ' - ', prefix = '
         acc[current_column][acc_none[current_column]] = acc[prev_column][acc_none[current_column]]
     
     return acc
+
+# Dimension cache. Raw records of dimension models are kept in {cache_dir}/{db}/{model_name}.ndjson.gz and the
+# cleaned model next to them in a parquet file. Each refresh fetches only records with a newer write_date plus an
+# id check for records deleted in Odoo, and the cleaner runs again over the whole model only when something changed,
+# so cleaners that look across rows (split_column pads categories to the deepest account) match a full clean.
+_dimension_memo = {}
+
+def get_odoo_dimension(odoo_model, db, uid, password, model_name, fields, cleaner, cache_dir, extra_filters = None, refresh = True):
+  
+  """
+  Get a cleaned dimension model (account.account, account.analytic.tag...) from a local cache,
+  refreshing it incrementally from odoo
+  
+  odoo_model: model object returned from xmlrpc call, or a transport from odoo_transport
+  db, uid, password: str credentials
+  model_name: str model name to query
+  fields: fields to query, id and write_date are always added
+  cleaner: function to clean the model e.g. clean_account, clean_analytic_tag
+  cache_dir: str directory of the cache
+  extra_filters: list difinning other filter to apply to the query
+  refresh: bool if False, serve the cache without calling odoo. The first call always fetches
+  
+  Every combination of fields, cleaner and extra_filters has its own cache, so changing any of them fetches the
+  model again instead of mixing records fetched with other fields or serving another cleaner's output
+  
+  return: pd.df with the cleaned model
+  """
+  
+  fields = list(dict.fromkeys(list(fields) + ['id', 'write_date']))
+  key = {
+    'fields': sorted(fields),
+    'cleaner': f"{cleaner.__module__}.{getattr(cleaner, '__qualname__', type(cleaner).__qualname__)}",
+    'extra_filters': extra_filters or None
+    }
+  digest = hashlib.sha256(json.dumps(key, sort_keys = True, default = str).encode()).hexdigest()[:16]
+  path = os.path.join(cache_dir, db, f'{model_name}-{digest}')
+  
+  cached = _read_dimension(path + '.parquet')
+  if cached is not None and not refresh:
+    return cached
+  
+  records = read_segment(path + '.ndjson.gz') if cached is not None and os.path.exists(path + '.ndjson.gz') else []
+  
+  checkpoint = '2000/01/01 00:00:00'
+  if records:
+    # One second back: records written in the same second as the last fetch are fetched again, not missed
+    last_write = coerce_datetime(pd.Series([max(r['write_date'] for r in records)]), source = 'odoo')[0]
+    checkpoint = (last_write - pd.Timedelta(seconds = 1)).strftime('%Y/%m/%d %H:%M:%S')
+  
+  call_filter = [['write_date', '>', checkpoint]] + ([extra_filters] if extra_filters else [])
+  with stage('fetch', source = 'odoo', target = model_name) as record:
+    new_records = odoo_model.execute_kw(db, uid, password, model_name, 'search_read', [call_filter], {'fields': fields})
+    record.add_request()
+    
+    by_id = {r['id']: r for r in records}
+    changed = [r for r in new_records if by_id.get(r['id']) != r]
+    by_id.update((r['id'], r) for r in changed)
+    
+    # Deletions: a count is enough when nothing was deleted, ids are only downloaded when counts differ
+    domain = [extra_filters] if extra_filters else []
+    count = odoo_model.execute_kw(db, uid, password, model_name, 'search_count', [domain])
+    record.add_request()
+    n_deleted = 0
+    if count != len(by_id):
+      ids = set(odoo_model.execute_kw(db, uid, password, model_name, 'search', [domain]))
+      record.add_request()
+      n_deleted = len(set(by_id) - ids)
+      by_id = {k: v for k, v in by_id.items() if k in ids}
+    
+    record.rows = len(changed)
+  
+  if cached is not None and not changed and not n_deleted:
+    logger.info('%s dimension: %s records, unchanged', model_name, len(cached))
+    return cached
+  
+  records = sorted(by_id.values(), key = lambda r: r['id'])
+  dimension = cleaner(records_to_df(records))
+  
+  os.makedirs(os.path.dirname(path), exist_ok = True)
+  write_segment(path + '.ndjson.gz', records)
+  _write_dimension(path + '.parquet', dimension)
+  
+  logger.info('%s dimension: %s records, %s refreshed, %s deleted', model_name, len(dimension), len(changed), n_deleted)
+  
+  return dimension
+
+def _read_dimension(path):
+  
+  try:
+    mtime = os.path.getmtime(path)
+  except FileNotFoundError:
+    return None
+  
+  memo = _dimension_memo.get(path)
+  if memo is None or memo[0] != mtime:
+    memo = _dimension_memo[path] = (mtime, pd.read_parquet(path))
+  
+  return memo[1].copy()
+
+def _write_dimension(path, df):
+  
+  df.to_parquet(path + '.tmp', index = False)
+  os.replace(path + '.tmp', path)
+  _dimension_memo[path] = (os.path.getmtime(path), df.copy())
+
+def enrich_move_line(move_line_df, accounts = None, analytic_tags = None):
+  
+  """
+  Join cached dimensions to the output of clean_move_line, in memory
+  
+  move_line_df: pd.df output of clean_move_line
+  accounts: pd.df output of clean_account, joined on account_id
+  analytic_tags: pd.df output of clean_analytic_tag, joined on analytic_tag_ids
+  
+  return: pd.df with the dimension columns added
+  """
+  
+  if move_line_df.empty:
+    return move_line_df
+  
+  enriched = move_line_df
+  
+  if accounts is not None:
+    account_columns = accounts.drop(columns = ['write_date'], errors = 'ignore').rename(columns = {'id': 'account_id'})
+    enriched = enriched.merge(account_columns, on = 'account_id', how = 'left', validate = 'many_to_one', suffixes = ('', '_account'))
+  
+  if analytic_tags is not None:
+    tag_columns = analytic_tags.drop(columns = ['write_date'], errors = 'ignore').rename(columns = {'id': 'analytic_tag_key'})
+    enriched = enriched.assign(analytic_tag_key = enriched['analytic_tag_ids'].map(int_to_string))
+    enriched = enriched.merge(tag_columns, on = 'analytic_tag_key', how = 'left', validate = 'many_to_one', suffixes = ('', '_analytic_tag'))
+    enriched = enriched.drop(columns = 'analytic_tag_key')
+  
+  enriched.index = move_line_df.index
+  
+  return enriched
@@ -0,0 +1,235 @@
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+import pandas as pd
+
+# Row-chunked cleaning in a process pool. Frames travel between processes as Arrow IPC streams in
+# shared memory blocks, so the pool only pickles a block name. Raw Odoo columns (many2one [id, name]
+# pairs, x2many id lists, False for empty values) are encoded with a lossless Arrow type and decoded
+# back to the same python objects. Other frames Arrow can not round-trip exactly and lists of raw
+# records (e.g. HubSpot objects) are still pickled.
+
+CODECS_KEY = b'vikuatools.codecs'
+
+def _is_many2one(v):
+  return isinstance(v, list) and len(v) == 2 and type(v[0]) is int and isinstance(v[1], str)
+
+def _codec(x):
+
+  """
+  x: pd.Series with object dtype
+
+  return: str codec of the column, 'string' if Arrow keeps it as is, or None if it must be pickled
+  """
+
+  kind = pd.api.types.infer_dtype(x, skipna = True)
+  if kind in ('string', 'empty'):
+    return 'string'
+
+  values = [v for v in x if v is not False]
+  if any(v is None for v in values):
+    # Codecs store False as null, None would come back as False
+    return None
+  if all(isinstance(v, str) for v in values):
+    return 'false_string'
+  if all(_is_many2one(v) for v in values):
+    return 'many2one'
+  if len(values) == len(x) and all(isinstance(v, list) and all(type(i) is int for i in v) for v in values):
+    return 'x2many'
+
+  return None
+
+def _arrow_codecs(df):
+
+  """
+  return: dict column -> codec of the object columns that need one, or None if df must be pickled
+  """
+
+  if not isinstance(df, pd.DataFrame) or not df.columns.is_unique:
+    return None
+
+  codecs = {}
+  for column in df.columns:
+    if not isinstance(column, str):
+      return None
+    if df[column].dtype == object:
+      codec = _codec(df[column])
+      if codec is None:
+        return None
+      if codec != 'string':
+        codecs[column] = codec
+
+  return codecs
+
+def _encode_column(x, codec):
+
+  import pyarrow as pa
+
+  if codec == 'false_string':
+    return pa.array([None if v is False else v for v in x], type = pa.string())
+  if codec == 'many2one':
+    return pa.array([None if v is False else {'id': v[0], 'name': v[1]} for v in x], type = pa.struct([('id', pa.int64()), ('name', pa.string())]))
+
+  return pa.array(list(x), type = pa.list_(pa.int64()))
+
+def _decode_column(values, codec):
+
+  if codec == 'false_string':
+    return [False if v is None else v for v in values]
+  if codec == 'many2one':
+    return [False if v is None else [v['id'], v['name']] for v in values]
+
+  return values
+
+def _encode(data):
+
+  codecs = _arrow_codecs(data)
+  if codecs is None:
+    return ('pickle', data)
+
+  import pyarrow as pa
+
+  try:
+    table = pa.Table.from_pandas(data.drop(columns = list(codecs)), preserve_index = True)
+    for column, codec in codecs.items():
+      table = table.append_column(column, _encode_column(data[column], codec))
+  except (pa.ArrowException, ValueError, TypeError, OverflowError):
+    return ('pickle', data)
+
+  # Codec columns are appended last, the metadata keeps the original column order
+  metadata = {'codecs': codecs, 'columns': list(data.columns)}
+  table = table.replace_schema_metadata({**table.schema.metadata, CODECS_KEY: json.dumps(metadata).encode()})
+
+  # Size the stream first, then serialize straight into the shared block without an intermediate copy
+  mock = pa.MockOutputStream()
+  with pa.ipc.new_stream(mock, table.schema) as writer:
+    writer.write_table(table)
+  size = mock.size()
+
+  shm = shared_memory.SharedMemory(create = True, size = max(size, 1))
+  _write_stream(shm.buf, table)
+  name = shm.name
+  shm.close()
+
+  return ('shm', name, size)
+
+# Arrow objects wrapping the block must be gone before SharedMemory.close(), keep them local to these helpers
+
+def _write_stream(block, table):
+
+  import pyarrow as pa
+
+  sink = pa.FixedSizeBufferWriter(pa.py_buffer(block))
+  with pa.ipc.new_stream(sink, table.schema) as writer:
+    writer.write_table(table)
+  sink.close()
+
+def _read_stream(block, size):
+
+  import pyarrow as pa
+
+  # to_pandas keeps views of the buffer for some columns, read from a private copy of the stream so
+  # the block can be released right away. A memcpy is still far cheaper than unpickling the frame
+  with pa.ipc.open_stream(pa.py_buffer(block[:size].tobytes())) as reader:
+    table = reader.read_all()
+
+  metadata = table.schema.metadata.get(CODECS_KEY)
+  if metadata is None:
+    return table.to_pandas()
+
+  metadata = json.loads(metadata)
+  codecs = metadata['codecs']
+  df = table.drop_columns(list(codecs)).to_pandas()
+  for column, codec in codecs.items():
+    df[column] = pd.Series(_decode_column(table.column(column).to_pylist(), codec), index = df.index, dtype = object)
+
+  return df[metadata['columns']]
+
+def _decode(payload, unlink = False):
+
+  if payload[0] == 'pickle':
+    return payload[1]
+
+  _, name, size = payload
+  shm = shared_memory.SharedMemory(name = name)
+  try:
+    df = _read_stream(shm.buf, size)
+  finally:
+    shm.close()
+    if unlink:
+      shm.unlink()
+
+  return df
+
+def _release(payload):
+
+  if payload[0] == 'shm':
+    try:
+      shm = shared_memory.SharedMemory(name = payload[1])
+      shm.close()
+      shm.unlink()
+    except FileNotFoundError:
+      pass
+
+def _clean_chunk(payload, cleaner, args, kwargs):
+
+  data = _decode(payload)
+
+  return _encode(cleaner(data, *args, **kwargs))
+
+def _split(data, chunk_size):
+
+  if isinstance(data, pd.DataFrame):
+    return [data.iloc[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+
+  return [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+
+def parallel_clean(cleaner, data, *args, processes = None, chunk_size = None, **kwargs):
+
+  """
+  Run a cleaner over row chunks of data in a process pool and put the results back in the original order.
+  The cleaner must be row-wise (every output row depends only on its input row), like odoo.clean_move_line,
+  odoo.clean_currency_rate or hubspot.clean_hubspot_response, and importable by the worker processes
+
+  cleaner: function receiving data chunk as first argument
+  data: pd.DataFrame or list of raw records
+  args, kwargs: extra arguments for cleaner
+  processes: int number of worker processes, default os.cpu_count()
+  chunk_size: int rows per chunk, default splits data in 4 chunks per process
+
+  return: cleaned output, same as cleaner(data, *args, **kwargs)
+  """
+
+  processes = processes or os.cpu_count() or 1
+  chunk_size = chunk_size or max(math.ceil(len(data) / (processes * 4)), 1)
+
+  if processes == 1 or len(data) <= chunk_size:
+    return cleaner(data, *args, **kwargs)
+
+  # Blocks are created in one process and unlinked in another. With fork, workers start their own resource
+  # tracker unless the parent's runs already, and that tracker reports the blocks the parent unlinks as leaked
+  resource_tracker.ensure_running()
+  
+  payloads = []
+  results = []
+  try:
+    with ProcessPoolExecutor(max_workers = processes) as executor:
+      futures = []
+      for chunk in _split(data, chunk_size):
+        payload = _encode(chunk)
+        payloads.append(payload)
+        futures.append(executor.submit(_clean_chunk, payload, cleaner, args, kwargs))
+
+      for future in futures:
+        results.append(_decode(future.result(), unlink = True))
+  finally:
+    for payload in payloads:
+      _release(payload)
+
+  if all(isinstance(r, pd.DataFrame) for r in results):
+    # Frames built from raw records get a fresh RangeIndex per chunk, renumber them like the serial path
+    return pd.concat(results, ignore_index = not isinstance(data, pd.DataFrame))
+
+  return [x for result in results for x in result]
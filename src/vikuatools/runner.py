@@ -0,0 +1,480 @@
+"""
+Declarative sync runner
+
+A job spec (TOML, YAML or JSON) lists extract -> clean -> load jobs. Jobs without pending
+dependencies run concurrently, with at most max_concurrency fetches per source and loads per
+'bigquery' at a time. The checkpoint of a job is saved only after its load succeeded.
+
+  max_workers = 4
+  state = "checkpoints.json"          # optional, default reads the checkpoint from the loaded table
+
+  [resources.bigquery]
+  factory = "google.cloud.bigquery:Client"
+  args = {project = "my-project"}
+
+  [resources.odoo]
+  factory = "vikuatools.odoo:odoo_transport"
+  args = {url = "https://erp.example.com", protocol = "jsonrpc"}
+
+  [sources.odoo]
+  max_concurrency = 2
+
+  [[jobs]]
+  name = "move_lines"
+  source = "odoo"
+  depends_on = ["accounts"]
+  fetch = "vikuatools.odoo:get_odoo_model"
+  fetch_args = {odoo_model = {resource = "odoo"}, db = "prod", uid = 2, password = {env = "ODOO_PASSWORD"}, model_name = "account.move.line", fields = ["id", "date", "write_date"]}
+  clean = "vikuatools.odoo:clean_move_line"
+  table = "my-project.odoo.move_line"
+  drop_id_field = "id"
+  checkpoint = {field = "write_date", argument = "checkpoint", format = "%Y/%m/%d %H:%M:%S", default = "2000-01-01"}
+
+Argument values are taken literally, except single key tables: {resource = name} for a resource,
+{env = NAME} for an environment variable, {ref = "module:attr"} for a python object,
+{schema = name} for a registered TableSchema and {now = format} for the current UTC time.
+Time formats are 'epoch_ms', 'epoch', 'iso' or a strftime format.
+"""
+
+import argparse
+import datetime as dt
+import importlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from vikuatools.instrument import stage
+
+logger = logging.getLogger(__name__)
+
+JOB_KEYS = ['name', 'source', 'depends_on', 'fetch', 'fetch_args', 'clean', 'clean_args', 'table', 'drop_id_field', 'schema', 'checkpoint']
+
+def load_spec(path):
+
+  """
+  Read a job spec file
+
+  path: str .toml, .yaml, .yml or .json file
+
+  return: dict
+  """
+
+  path = os.fspath(path)
+
+  if path.endswith('.toml'):
+    try:
+      import tomllib
+    except ImportError:
+      # python < 3.11
+      import tomli as tomllib
+    with open(path, 'rb') as f:
+      return tomllib.load(f)
+
+  if path.endswith(('.yaml', '.yml')):
+    import yaml
+    with open(path) as f:
+      return yaml.safe_load(f)
+
+  with open(path) as f:
+    return json.load(f)
+
+def import_object(reference):
+
+  """
+  reference: str 'module:attr', e.g. 'vikuatools.odoo:get_odoo_model'
+
+  return: the python object
+  """
+
+  module, _, attr = reference.partition(':')
+  if not attr:
+    raise ValueError(f"reference must look like 'module:attr', got '{reference}'")
+
+  obj = importlib.import_module(module)
+  for name in attr.split('.'):
+    obj = getattr(obj, name)
+
+  return obj
+
+def format_time(value, fmt = None):
+
+  """
+  value: datetime-like, naive values are taken as UTC
+  fmt: str 'epoch_ms', 'epoch', 'iso', a strftime format or None
+
+  return: value formatted, or a naive UTC datetime if fmt is None
+  """
+
+  import pandas as pd
+
+  ts = pd.Timestamp(value)
+  ts = ts.tz_localize(None) if ts.tz is None else ts.tz_convert('UTC').tz_localize(None)
+
+  if fmt == 'epoch_ms':
+    return ts.value // 10 ** 6
+  if fmt == 'epoch':
+    return ts.value // 10 ** 9
+  if fmt == 'iso':
+    return ts.isoformat()
+  if fmt:
+    return ts.strftime(fmt)
+
+  return ts.to_pydatetime()
+
+class Resources:
+
+  """
+  Clients and connections shared by jobs, built on first use from the spec 'resources' table
+
+  specs: dict name -> {'factory': 'module:attr', 'args': dict}
+  provided: dict name -> object, used instead of building the resource
+  """
+
+  def __init__(self, specs = None, provided = None):
+
+    self.specs = specs or {}
+    self.objects = dict(provided or {})
+    self._lock = threading.RLock()
+
+  def get(self, name):
+
+    with self._lock:
+      if name not in self.objects:
+        if name not in self.specs:
+          raise KeyError(f"unknown resource '{name}', define it in [resources.{name}]")
+        spec = self.specs[name]
+        self.objects[name] = import_object(spec['factory'])(**resolve(spec.get('args', {}), self))
+
+    return self.objects[name]
+
+def resolve(value, resources):
+
+  """
+  Resolve the special single key tables of a spec value, recursively
+
+  value: spec value
+  resources: Resources
+
+  return: resolved value
+  """
+
+  if isinstance(value, dict):
+    if len(value) == 1:
+      (key, arg), = value.items()
+      if key == 'resource':
+        return resources.get(arg)
+      if key == 'env':
+        try:
+          return os.environ[arg]
+        except KeyError:
+          raise KeyError(f"environment variable '{arg}' is not set") from None
+      if key == 'ref':
+        return import_object(arg)
+      if key == 'schema':
+        from vikuatools.schema import get_schema
+        return get_schema(arg)
+      if key == 'now':
+        return format_time(dt.datetime.now(dt.timezone.utc), arg)
+    return {k: resolve(v, resources) for k, v in value.items()}
+
+  if isinstance(value, list):
+    return [resolve(v, resources) for v in value]
+
+  return value
+
+class CheckpointStore:
+
+  """
+  Last loaded checkpoint of every job, in a json file replaced atomically
+
+  path: str json file, created on first save
+  """
+
+  def __init__(self, path):
+
+    self.path = os.fspath(path)
+    self._lock = threading.Lock()
+    try:
+      with open(self.path) as f:
+        self.checkpoints = json.load(f)
+    except FileNotFoundError:
+      self.checkpoints = {}
+
+  def get(self, job):
+    return self.checkpoints.get(job)
+
+  def save(self, job, value):
+
+    with self._lock:
+      self.checkpoints[job] = format_time(value, 'iso')
+      with open(self.path + '.tmp', 'w') as f:
+        json.dump(self.checkpoints, f, indent = 2, sort_keys = True)
+      os.replace(self.path + '.tmp', self.path)
+
+def plan(jobs, only = None):
+
+  """
+  Validate jobs and sort them in dependency order
+
+  jobs: list of job dicts from the spec
+  only: list of job names to keep, together with the jobs they depend on. Default all
+
+  return: list of levels, every level a list of job names that only depend on previous levels
+  """
+
+  by_name = {}
+  for job in jobs:
+    unknown = set(job) - set(JOB_KEYS)
+    if unknown:
+      raise ValueError(f"job '{job.get('name')}': unknown keys {sorted(unknown)}")
+    if 'name' not in job or 'fetch' not in job:
+      raise ValueError(f'every job needs a name and a fetch function, got {job}')
+    if job['name'] in by_name:
+      raise ValueError(f"duplicated job name '{job['name']}'")
+    by_name[job['name']] = job
+
+  for job in jobs:
+    missing = set(job.get('depends_on', [])) - set(by_name)
+    if missing:
+      raise ValueError(f"job '{job['name']}' depends on unknown jobs {sorted(missing)}")
+
+  selected = set(by_name)
+  if only:
+    selected, stack = set(), list(only)
+    while stack:
+      name = stack.pop()
+      if name not in by_name:
+        raise ValueError(f"unknown job '{name}'")
+      if name not in selected:
+        selected.add(name)
+        stack.extend(by_name[name].get('depends_on', []))
+
+  levels, done = [], set()
+  remaining = [job['name'] for job in jobs if job['name'] in selected]
+  while remaining:
+    level = [name for name in remaining if set(by_name[name].get('depends_on', [])) <= done]
+    if not level:
+      raise ValueError(f'dependency cycle between jobs {remaining}')
+    levels.append(level)
+    done.update(level)
+    remaining = [name for name in remaining if name not in done]
+
+  return levels
+
+class _Runner:
+
+  def __init__(self, spec, resources, state):
+
+    self.spec = spec
+    self.resources = resources
+    self.state = state
+    self.bq_client_name = spec.get('bq_client', 'bigquery')
+    self.limits = {
+      source: threading.BoundedSemaphore(conf.get('max_concurrency', 1))
+      for source, conf in spec.get('sources', {}).items()
+      }
+
+  def limit(self, source):
+    return self.limits.get(source) or nullcontext()
+
+  def checkpoint(self, job):
+
+    conf = job.get('checkpoint')
+    if not conf:
+      return None
+
+    value = self.state.get(job['name']) if self.state is not None else None
+
+    if value is None and conf.get('field') and job.get('table'):
+      from google.api_core.exceptions import NotFound
+      from vikuatools.bigquery import bq_get_last_updated_object
+      project, dataset, table = job['table'].split('.')
+      try:
+        with self.limit('bigquery'):
+          value = bq_get_last_updated_object(self.resources.get(self.bq_client_name), project, dataset, table, conf['field'])
+      except NotFound:
+        # First run, the load creates the table
+        logger.info('%s does not exist yet, %s starts from the default checkpoint', job['table'], job['name'])
+
+    if value is None or value != value:
+      value = conf.get('default')
+
+    return None if value is None else format_time(value, conf.get('format'))
+
+  def run_job(self, job):
+
+    name, source = job['name'], job.get('source')
+    result = {'job': name, 'source': source, 'status': 'running', 'rows': None, 'fetch_seconds': None,
+      'clean_seconds': None, 'load_seconds': None, 'seconds': None, 'checkpoint': None, 'error': None}
+    start = time.perf_counter()
+
+    try:
+      with stage('job', source = source, target = name) as record:
+        checkpoint = self.checkpoint(job)
+        result['checkpoint'] = checkpoint
+        fetch_args = resolve(job.get('fetch_args', {}), self.resources)
+        conf = job.get('checkpoint') or {}
+        if checkpoint is not None and conf.get('argument'):
+          _set_path(fetch_args, conf['argument'], checkpoint)
+
+        t = time.perf_counter()
+        with self.limit(source):
+          data = import_object(job['fetch'])(**fetch_args)
+        result['fetch_seconds'] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        if job.get('clean'):
+          data = import_object(job['clean'])(data, **resolve(job.get('clean_args', {}), self.resources))
+        result['clean_seconds'] = time.perf_counter() - t
+        result['rows'] = record.rows = len(data)
+
+        if job.get('table'):
+          from vikuatools.bigquery import load_table_from_dataframe_safely
+          t = time.perf_counter()
+          with self.limit('bigquery'):
+            load_table_from_dataframe_safely(
+              self.resources.get(self.bq_client_name), data, job['table'],
+              drop_id_field = job.get('drop_id_field'), schema = job.get('schema')
+              )
+          result['load_seconds'] = time.perf_counter() - t
+
+        # Saved only now: a failed fetch, clean or load leaves the previous checkpoint in place
+        field = conf.get('field')
+        if self.state is not None and field and len(data) and field in data:
+          newest = data[field].max()
+          if newest == newest:
+            self.state.save(name, newest)
+
+      result['status'] = 'ok'
+
+    except Exception as e:
+      logger.exception('job %s failed', name)
+      result['status'] = 'failed'
+      result['error'] = f'{type(e).__name__}: {e}'
+
+    result['seconds'] = time.perf_counter() - start
+
+    return result
+
+def _set_path(args, path, value):
+
+  # 'parameters.since' sets args['parameters']['since']
+  keys = path.split('.')
+  for key in keys[:-1]:
+    args = args.setdefault(key, {})
+  args[keys[-1]] = value
+
+def run_spec(spec, resources = None, only = None, max_workers = None):
+
+  """
+  Run the jobs of a spec
+
+  spec: dict output of load_spec
+  resources: dict name -> object, e.g. clients built by the caller. They take precedence over spec resources
+  only: list of job names to run, together with the jobs they depend on. Default all
+  max_workers: int jobs running at the same time, default spec max_workers or 4
+
+  return: list of per job result dicts in completion order, with status 'ok', 'failed' or 'skipped'
+  """
+
+  from vikuatools.schema import register_schema
+
+  for table, conf in spec.get('schemas', {}).items():
+    register_schema(table, conf['columns'], source = conf.get('source'), strict = conf.get('strict', False))
+
+  jobs = {job['name']: job for job in spec.get('jobs', [])}
+  levels = plan(spec.get('jobs', []), only)
+  order = [name for level in levels for name in level]
+
+  state = CheckpointStore(spec['state']) if spec.get('state') else None
+  runner = _Runner(spec, Resources(spec.get('resources'), resources), state)
+
+  results = {}
+  ok = set()
+  with ThreadPoolExecutor(max_workers = max_workers or spec.get('max_workers', 4)) as executor:
+    pending = {}
+
+    def submit_ready():
+      # order is topological, so a skipped job is seen by its dependents in the same pass
+      for name in order:
+        if name in results or name in pending.values():
+          continue
+        deps = set(jobs[name].get('depends_on', []))
+        blocked = [d for d in deps if d in results and d not in ok]
+        if blocked:
+          results[name] = {'job': name, 'source': jobs[name].get('source'), 'status': 'skipped', 'rows': None,
+            'fetch_seconds': None, 'clean_seconds': None, 'load_seconds': None, 'seconds': None,
+            'checkpoint': None, 'error': f'dependency {blocked[0]} did not succeed'}
+          logger.warning('job %s skipped: %s', name, results[name]['error'])
+        elif deps <= ok:
+          pending[executor.submit(runner.run_job, jobs[name])] = name
+
+    submit_ready()
+    while pending:
+      done, _ = wait(pending, return_when = FIRST_COMPLETED)
+      for future in done:
+        name = pending.pop(future)
+        results[name] = future.result()
+        if results[name]['status'] == 'ok':
+          ok.add(name)
+        logger.info('job %s %s in %.2fs', name, results[name]['status'], results[name]['seconds'])
+      submit_ready()
+
+  return list(results.values())
+
+def format_summary(results):
+
+  """
+  results: list output of run_spec
+
+  return: str table with status, rows and seconds per stage of every job
+  """
+
+  def seconds(x):
+    return f'{x:>9.2f}' if x is not None else f"{'-':>9}"
+
+  lines = [f"{'job':<28}{'source':<12}{'status':<9}{'rows':>10}{'fetch':>9}{'clean':>9}{'load':>9}{'total':>9}"]
+  for r in results:
+    rows = r['rows'] if r['rows'] is not None else '-'
+    lines.append(
+      f"{r['job']:<28}{r['source'] or '-':<12}{r['status']:<9}{rows:>10}"
+      f"{seconds(r['fetch_seconds'])}{seconds(r['clean_seconds'])}{seconds(r['load_seconds'])}{seconds(r['seconds'])}"
+      )
+    if r['error']:
+      lines.append(f"  {r['error']}")
+
+  return '\n'.join(lines)
+
+def main(argv = None):
+
+  parser = argparse.ArgumentParser(prog = 'vikuatools', description = 'Run extract, clean and load jobs declared in a spec file')
+  subparsers = parser.add_subparsers(dest = 'command', required = True)
+
+  run_parser = subparsers.add_parser('run', help = 'run the jobs of a spec')
+  plan_parser = subparsers.add_parser('plan', help = 'print the jobs of a spec in dependency order')
+  for sub in [run_parser, plan_parser]:
+    sub.add_argument('spec', help = 'job spec, .toml, .yaml or .json')
+    sub.add_argument('--job', action = 'append', help = 'jobs to run with their dependencies, default all')
+  run_parser.add_argument('--max-workers', type = int)
+  run_parser.add_argument('--log-level', default = 'INFO')
+  args = parser.parse_args(argv)
+
+  spec = load_spec(args.spec)
+
+  if args.command == 'plan':
+    for i, level in enumerate(plan(spec.get('jobs', []), args.job)):
+      print(f"{i}: {', '.join(level)}")
+    return 0
+
+  logging.basicConfig(level = args.log_level.upper(), format = '%(asctime)s %(levelname)s %(name)s: %(message)s')
+  results = run_spec(spec, only = args.job, max_workers = args.max_workers)
+  print(format_summary(results))
+
+  return 0 if all(r['status'] == 'ok' for r in results) else 1
+
+if __name__ == '__main__':
+  sys.exit(main())
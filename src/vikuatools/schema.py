@@ -0,0 +1,216 @@
+import logging
+import pandas as pd
+from vikuatools.utils import int_to_string, coerce_datetime
+
+# Declarative table schemas. One spec per table lists the type of every column; from it come the
+# parse plan of the source module (the parse_column dict of clean_hubspot_response), the compact
+# pandas dtypes frames are cast to before loading, and a cached bigquery.LoadJobConfig so loads
+# never rely on schema autodetection.
+
+logger = logging.getLogger(__name__)
+
+# type: (pandas dtype, BigQuery type, parse_properties plan key)
+TYPES = {
+  'string': ('string', 'STRING', None),
+  'category': ('category', 'STRING', None),
+  'integer': ('Int64', 'INT64', 'to_integer'),
+  'float': ('float64', 'FLOAT64', 'to_numeric'),
+  'boolean': ('boolean', 'BOOL', 'to_boolean'),
+  'datetime': ('datetime64[ns]', 'DATETIME', 'to_datetime'),
+  'timestamp': ('datetime64[ns, UTC]', 'TIMESTAMP', 'to_datetime'),
+  'date': ('dbdate', 'DATE', 'to_datetime')
+  }
+
+BOOLEAN_STRINGS = {'true': True, 'false': False, 'True': True, 'False': False, '': None}
+
+_registry = {}
+
+class TableSchema:
+
+  """
+  Column types of one table
+
+  name: str table name e.g. 'deals', 'account_move_line'
+  columns: dict column name -> type, one of TYPES, or dict with 'type' and optional 'mode' ('NULLABLE' or 'REQUIRED')
+    and 'description'
+  source: str source of the raw values passed to coerce_datetime, one of 'odoo', 'graph', 'hubspot' or None
+  strict: bool raise on columns outside the schema instead of dropping them
+  """
+
+  def __init__(self, name, columns, source = None, strict = False):
+
+    self.name = name
+    self.source = source
+    self.strict = strict
+    self.columns = {}
+
+    for column, spec in columns.items():
+      spec = {'type': spec} if isinstance(spec, str) else dict(spec)
+      if spec['type'] not in TYPES:
+        raise ValueError(f"column '{column}' of '{name}': type must be one of {list(TYPES)}, got '{spec['type']}'")
+      spec.setdefault('mode', 'NULLABLE')
+      self.columns[column] = spec
+
+    self._job_config = None
+
+  def __repr__(self):
+    return f"TableSchema('{self.name}', columns={len(self.columns)}, source={self.source!r})"
+
+  @property
+  def dtypes(self):
+
+    """
+    return: dict column -> pandas dtype
+    """
+
+    return {column: TYPES[spec['type']][0] for column, spec in self.columns.items()}
+
+  def parse_plan(self):
+
+    """
+    return: dict with 'to_integer', 'to_datetime', 'to_numeric' and 'to_boolean' column lists, the parse_column
+      argument of hubspot.clean_hubspot_response. A new dict every call, the cleaner edits it in place
+    """
+
+    plan = {'to_integer': [], 'to_datetime': [], 'to_numeric': [], 'to_boolean': []}
+    for column, spec in self.columns.items():
+      key = TYPES[spec['type']][2]
+      if key:
+        plan[key].append(column)
+
+    return plan
+
+  def bq_schema(self):
+
+    """
+    return: list of bigquery.SchemaField in column order
+    """
+
+    from google.cloud import bigquery
+
+    return [
+      bigquery.SchemaField(column, TYPES[spec['type']][1], mode = spec['mode'], description = spec.get('description'))
+      for column, spec in self.columns.items()
+      ]
+
+  def job_config(self):
+
+    """
+    LoadJobConfig with the explicit schema, built once per table. It is shared by every load of the table, do not modify it
+
+    return: bigquery.LoadJobConfig
+    """
+
+    if self._job_config is None:
+      from google.cloud import bigquery
+      self._job_config = bigquery.LoadJobConfig(schema = self.bq_schema())
+
+    return self._job_config
+
+  def cast(self, df):
+
+    """
+    Cast df columns to the schema dtypes. Missing columns are added as nulls, so a column that came back empty
+    keeps its type. Columns outside the schema are dropped, or raise a ValueError if the schema is strict: loaded
+    with the schema job config, BigQuery would autodetect their type again
+
+    df: pd.DataFrame
+
+    return: pd.DataFrame with exactly the schema columns, in schema order
+    """
+
+    extra = [column for column in df.columns if column not in self.columns]
+    if extra and self.strict:
+      raise ValueError(f'{self.name}: columns outside the schema {extra}')
+    if extra:
+      logger.warning('%s: dropping columns outside the schema %s', self.name, extra)
+
+    cast = {}
+    for column, spec in self.columns.items():
+      if column in df:
+        cast[column] = _cast_column(df[column], spec['type'], self.source)
+      else:
+        cast[column] = _cast_column(pd.Series(None, index = df.index, dtype = object), spec['type'], self.source)
+
+    return pd.DataFrame(cast, index = df.index)
+
+def _cast_column(x, type_, source):
+
+  dtype = TYPES[type_][0]
+  if str(x.dtype) == dtype:
+    return x
+
+  if type_ in ('string', 'category'):
+    if pd.api.types.is_numeric_dtype(x) and not pd.api.types.is_bool_dtype(x):
+      # ids parsed as numbers, 5.0 must load as '5'
+      x = x.map(int_to_string, na_action = 'ignore')
+    x = x.astype('string')
+    return x.astype('category') if type_ == 'category' else x
+
+  if type_ == 'integer':
+    x = pd.to_numeric(x, errors = 'coerce')
+    if pd.api.types.is_float_dtype(x):
+      # Drifted values like '2.5' cannot be cast to Int64, they load as nulls
+      fractional = x.notna() & (x % 1 != 0)
+      if fractional.any():
+        logger.warning("'%s': %s non integer values set to null", x.name, fractional.sum())
+        x = x.mask(fractional)
+    return x.astype('Int64')
+
+  if type_ == 'float':
+    return pd.to_numeric(x, errors = 'coerce').astype('float64')
+
+  if type_ == 'boolean':
+    if x.dtype == object:
+      x = x.map(lambda v: BOOLEAN_STRINGS.get(v, v) if isinstance(v, str) else v)
+    return x.astype('boolean')
+
+  parsed = coerce_datetime(x, source = source, utc = type_ == 'timestamp')
+  if type_ == 'date':
+    import db_dtypes # registers the dbdate dtype
+    return parsed.dt.normalize().astype('dbdate')
+
+  # parquet and BigQuery round trips give datetime64[us]
+  return parsed.astype(dtype)
+
+def register_schema(name, columns, source = None, strict = False):
+
+  """
+  Declare the schema of a table, replacing any previous one with the same name
+
+  name: str table name
+  columns: dict column name -> type, see TableSchema
+  source: str one of 'odoo', 'graph', 'hubspot' or None
+  strict: bool raise on columns outside the schema instead of dropping them
+
+  return: TableSchema
+  """
+
+  schema = TableSchema(name, columns, source = source, strict = strict)
+  _registry[name] = schema
+
+  return schema
+
+def get_schema(name):
+
+  """
+  name: str table name given to register_schema, or a TableSchema which is returned as is
+
+  return: TableSchema
+  """
+
+  if isinstance(name, TableSchema):
+    return name
+
+  try:
+    return _registry[name]
+  except KeyError:
+    raise KeyError(f"no schema registered for '{name}', known tables: {sorted(_registry)}") from None
+
+def registered_schemas():
+
+  """
+  return: list of registered table names
+  """
+
+  return sorted(_registry)
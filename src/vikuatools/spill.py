@@ -0,0 +1,219 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from itertools import islice
+from vikuatools.utils import decode_json
+
+logger = logging.getLogger(__name__)
+
+# Spill raw API pages to segment files in a working directory as they arrive, so backfills never
+# hold the whole response in memory. A '_state.json' file records the finished segments and the
+# pagination cursor after each one, and is replaced atomically, so a crashed extraction resumes
+# from the last completed segment. The state also keeps a digest of the request that filled the
+# directory, so a directory reused for a different request is reset instead of returning old data.
+
+STATE_FILE = '_state.json'
+FORMATS = {'ndjson': '.ndjson.gz', 'parquet': '.parquet'}
+
+def _write_atomically(path, write_fun):
+
+  tmp_path = f'{path}.tmp'
+  write_fun(tmp_path)
+  os.replace(tmp_path, path)
+
+def write_segment(path, records, fmt = 'ndjson'):
+
+  """
+  Write a list of raw records to a segment file
+
+  path: str destination file
+  records: list of json serializable records
+  fmt: str 'ndjson' (gzip compressed) or 'parquet' (one json document per row in a zstd compressed 'record' column)
+
+  return: path
+  """
+
+  if fmt == 'ndjson':
+    def write(tmp_path):
+      with gzip.open(tmp_path, 'wt', compresslevel = 3) as f:
+        for record in records:
+          f.write(json.dumps(record))
+          f.write('\n')
+
+  elif fmt == 'parquet':
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    def write(tmp_path):
+      table = pa.table({'record': pa.array([json.dumps(record) for record in records], type = pa.string())})
+      pq.write_table(table, tmp_path, compression = 'zstd')
+
+  else:
+    raise ValueError(f"fmt must be one of {list(FORMATS)}, got '{fmt}'")
+
+  _write_atomically(path, write)
+
+  return path
+
+def read_segment(path):
+
+  """
+  Read a segment file written by write_segment
+
+  path: str segment file
+
+  return: list of records
+  """
+
+  if path.endswith(FORMATS['parquet']):
+    import pyarrow.parquet as pq
+    return [decode_json(x) for x in pq.read_table(path, columns = ['record']).column('record').to_pylist()]
+
+  with gzip.open(path, 'rb') as f:
+    return [decode_json(line) for line in f]
+
+class SpillDir:
+
+  """
+  Segments of one extraction stored in a working directory
+
+  path: str working directory, created if it does not exist
+  fmt: str 'ndjson' or 'parquet'. Ignored when resuming, the stored format is kept
+  request: json serializable identity of the request that fills the directory e.g. url and parameters.
+    Stored segments of a different request are deleted and the extraction starts over
+  """
+
+  def __init__(self, path, fmt = 'ndjson', request = None):
+
+    if fmt not in FORMATS:
+      raise ValueError(f"fmt must be one of {list(FORMATS)}, got '{fmt}'")
+
+    self.path = os.fspath(path)
+    os.makedirs(self.path, exist_ok = True)
+    self._state_path = os.path.join(self.path, STATE_FILE)
+
+    # Digest only: request parameters may hold api keys that must not end up on disk
+    digest = None if request is None else hashlib.sha256(json.dumps(request, sort_keys = True, default = str).encode()).hexdigest()
+
+    try:
+      with open(self._state_path) as f:
+        self.state = json.load(f)
+    except FileNotFoundError:
+      self.state = None
+
+    if self.state is not None and self.state.get('request') != digest:
+      logger.warning('%s holds segments of another request, starting over', self.path)
+      for segment in self.segments:
+        if os.path.exists(segment):
+          os.remove(segment)
+      self.state = None
+
+    if self.state is None:
+      self.state = {'format': fmt, 'request': digest, 'segments': [], 'rows': 0, 'cursor': {}, 'complete': False}
+
+  @property
+  def fmt(self):
+    return self.state['format']
+
+  @property
+  def cursor(self):
+    return self.state['cursor']
+
+  @property
+  def complete(self):
+    return self.state['complete']
+
+  @property
+  def segments(self):
+    return [os.path.join(self.path, name) for name, _ in self.state['segments']]
+
+  def _save_state(self):
+
+    def write(tmp_path):
+      with open(tmp_path, 'w') as f:
+        json.dump(self.state, f)
+
+    _write_atomically(self._state_path, write)
+
+  def write_segment(self, records, cursor = None):
+
+    """
+    Store one page of records and the cursor that fetches the next page
+
+    records: list of raw records
+    cursor: dict pagination parameters to resume after this segment
+    """
+
+    name = f"segment-{len(self.state['segments']):06d}{FORMATS[self.fmt]}"
+    write_segment(os.path.join(self.path, name), records, self.fmt)
+
+    self.state['segments'].append([name, len(records)])
+    self.state['rows'] += len(records)
+    if cursor is not None:
+      self.state['cursor'] = cursor
+    self._save_state()
+
+  def mark_complete(self):
+
+    self.state['complete'] = True
+    self._save_state()
+
+  def iter_segments(self):
+
+    """
+    return: generator with the list of records of every segment, in fetch order
+    """
+
+    for path in self.segments:
+      yield read_segment(path)
+
+  def __iter__(self):
+
+    for records in self.iter_segments():
+      yield from records
+
+  def __len__(self):
+    return self.state['rows']
+
+  def __repr__(self):
+    return f"SpillDir('{self.path}', segments={len(self.state['segments'])}, rows={len(self)}, complete={self.complete})"
+
+def _clean_segment(path, cleaner, prepare, args, kwargs):
+
+  data = read_segment(path)
+  if prepare is not None:
+    data = prepare(data)
+
+  return cleaner(data, *args, **kwargs)
+
+def clean_segments(spill, cleaner, *args, prepare = None, processes = None, **kwargs):
+
+  """
+  Lazily run a cleaner over every segment of a SpillDir, optionally in a process pool
+
+  spill: SpillDir
+  cleaner: function receiving the segment data as first argument e.g. clean_hubspot_response, odoo.clean_move_line
+  args, kwargs: extra arguments for cleaner
+  prepare: function applied to the list of records before cleaning e.g. odoo.records_to_df
+  processes: int number of worker processes. None or 1 cleans in this process. cleaner and prepare must be importable functions
+
+  return: generator with one cleaned output per segment, in fetch order. With processes, at most processes * 2
+    segments are cleaned ahead of the caller, so a slow consumer (e.g. load_frames_safely) never holds the whole
+    cleaned dataset in memory
+  """
+
+  if not processes or processes == 1:
+    for path in spill.segments:
+      yield _clean_segment(path, cleaner, prepare, args, kwargs)
+    return
+
+  paths = iter(spill.segments)
+  with ProcessPoolExecutor(max_workers = processes) as executor:
+    pending = deque(executor.submit(_clean_segment, path, cleaner, prepare, args, kwargs) for path in islice(paths, processes * 2))
+    while pending:
+      yield pending.popleft().result()
+      for path in islice(paths, 1):
+        pending.append(executor.submit(_clean_segment, path, cleaner, prepare, args, kwargs))
@@ -2,6 +2,24 @@ import pandas as pd
 import datetime as dt
 import requests
 import json
+import logging
+import threading
+from vikuatools.instrument import stage
+
+logger = logging.getLogger(__name__)
+
+# Optional accelerated json decoders, used by decode_json when installed
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+try:
+  import simdjson
+except ImportError:
+  simdjson = None
+
+_simdjson_parsers = threading.local()
 
 def timestamp_to_unix(x):
   
@@ -32,7 +50,7 @@ def parse_properties(df, columns_to_integer=None, columns_to_datetime=None, colu
     df[columns_to_integer] = df[columns_to_integer].apply(string_to_integer)
   
   if columns_to_datetime:
-    df[columns_to_datetime] = df[columns_to_datetime].apply(pd.to_datetime, unit = dt_unit)
+    df[columns_to_datetime] = coerce_datetime(df[columns_to_datetime], source = 'hubspot', unit = dt_unit)
   
   if columns_to_numeric:
     df[columns_to_numeric] = df[columns_to_numeric].apply(pd.to_numeric, errors = 'coerce', downcast='float')
@@ -45,6 +63,68 @@ def parse_properties(df, columns_to_integer=None, columns_to_datetime=None, colu
   
   return df
 
+# Known string formats per source, tried in order before falling back to format inference
+DATETIME_FORMATS = {
+  'odoo': ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d'],
+  'graph': ['%Y-%m-%dT%H:%M:%S%z'],
+  'hubspot': []
+  }
+
+def coerce_datetime(x, source = None, utc = False, unit = 'ms'):
+  
+  """
+  Parse a whole column (or every column of a df) to datetime at once, using the known format of each source
+  instead of inferring the format element by element. Values are converted to UTC.
+  
+  x: pd.Series or pd.DataFrame
+  source: str one of 'odoo' (server strings in UTC, False as null), 'graph' (ISO-8601 with offset),
+    'hubspot' (epoch numbers in 'unit', or ISO-8601 strings from the v3 API) or None to infer the format
+  utc: bool keep the result tz-aware in UTC. If False, return naive datetimes in UTC
+  unit: str epoch unit for hubspot
+  
+  return: same type as x with datetime64 columns
+  """
+  
+  if isinstance(x, pd.DataFrame):
+    return x.apply(coerce_datetime, source = source, utc = utc, unit = unit)
+  
+  if pd.api.types.is_datetime64_any_dtype(x):
+    parsed = x.dt.tz_localize('UTC') if x.dt.tz is None else x.dt.tz_convert('UTC')
+  
+  elif source == 'hubspot' and pd.api.types.is_numeric_dtype(x):
+    parsed = pd.to_datetime(x, unit = unit, utc = True)
+  
+  elif source == 'hubspot':
+    numeric = pd.to_numeric(x, errors = 'coerce')
+    if numeric.count() == (x.notna() & x.ne('')).sum():
+      parsed = pd.to_datetime(numeric, unit = unit, utc = True)
+    else:
+      parsed = _parse_datetime_strings(x, [])
+  
+  else:
+    if source == 'odoo' and x.dtype == object:
+      x = x.where(x.ne(False), None)
+    parsed = _parse_datetime_strings(x, DATETIME_FORMATS.get(source, []))
+  
+  if not utc:
+    parsed = parsed.dt.tz_convert(None)
+  
+  return parsed
+
+def _parse_datetime_strings(x, formats):
+  
+  for fmt in formats:
+    try:
+      return pd.to_datetime(x, format = fmt, utc = True)
+    except (ValueError, TypeError):
+      continue
+  
+  try:
+    return pd.to_datetime(x, format = 'ISO8601', utc = True)
+  except (ValueError, TypeError):
+    # pandas < 2.0 has no ISO8601 format, let it infer the format once for the whole column
+    return pd.to_datetime(x, utc = True)
+
 def remove_value_from_dict_key(dict_, values_to_rm):
   
   """
@@ -76,7 +156,7 @@ def one_to_many(df, one, many, convert_to_string = True):
   """
   
   if df.empty:
-    print('No dataframe to convert')
+    logger.info('No dataframe to convert')
     return pd.DataFrame()
   
   map_assoc = df[[one, many]].explode(many).dropna().reset_index(drop = True)
@@ -153,6 +233,69 @@ def unlist_column(df: pd.DataFrame(), list_column: str, new_column_names: list):
   
   return df_copy
 
+def hash_rows(df, columns = None):
+  
+  """
+  Vectorized 64 bit fingerprint of every row, stable across runs and column order
+  
+  df: pd.DataFrame
+  columns: list of columns to hash, default all
+  
+  return: pd.Series of uint64 aligned with df index
+  """
+  
+  subset = df[sorted(df.columns if columns is None else columns)]
+  if subset.columns.empty:
+    # nothing to fingerprint, every row gets the same hash
+    return pd.Series(0, index = df.index, dtype = 'uint64')
+  
+  try:
+    return pd.util.hash_pandas_object(subset, index = False)
+  except TypeError:
+    # list or dict values (e.g. odoo many2many ids) are not hashable, fingerprint their repr
+    object_columns = subset.columns[subset.dtypes == object]
+    subset = subset.astype({c: str for c in object_columns})
+    return pd.util.hash_pandas_object(subset, index = False)
+
+def decode_json(content, fields = None):
+  
+  """
+  Decode a json document straight from the raw response bytes. Uses orjson when installed and the stdlib otherwise.
+  If fields is set, only those top level keys are kept, and with pysimdjson installed only those are materialized
+  
+  content: bytes or str json document, e.g. requests.Response.content
+  fields: list of top level keys to keep e.g. ['results', 'hasMore', 'offset']
+  
+  return: decoded document
+  """
+  
+  if fields is not None and simdjson is not None:
+    parser = getattr(_simdjson_parsers, 'parser', None)
+    if parser is None:
+      parser = _simdjson_parsers.parser = simdjson.Parser()
+    doc = parser.parse(content if isinstance(content, bytes) else content.encode())
+    if isinstance(doc, simdjson.Object):
+      # The parser reuses its buffer on the next parse, materialize before returning
+      return {k: _simdjson_to_python(doc[k]) for k in fields if k in doc}
+    return _simdjson_to_python(doc)
+  
+  data = orjson.loads(content) if orjson is not None else json.loads(content)
+  
+  if fields is not None and isinstance(data, dict):
+    return {k: data[k] for k in fields if k in data}
+  
+  return data
+
+def _simdjson_to_python(value):
+  
+  if isinstance(value, simdjson.Object):
+    return value.as_dict()
+  
+  if isinstance(value, simdjson.Array):
+    return value.as_list()
+  
+  return value
+
 def get_request(base_url, parameters = {}, header = {}):
   
   """
@@ -165,7 +308,9 @@ def get_request(base_url, parameters = {}, header = {}):
   return: list
   """
   
-  req = requests.get(base_url, params = parameters, headers = header)
-  respond = json.loads(req.content)
+  with stage('fetch', source = 'http', target = base_url) as record:
+    req = requests.get(base_url, params = parameters, headers = header)
+    record.add_request(len(req.content))
+    respond = decode_json(req.content)
   
   return respond
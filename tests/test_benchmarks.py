@@ -0,0 +1,23 @@
+import os
+import vikuatools
+from benchmarks import generators, imports, run
+
+def test_generators_are_seeded():
+	""" Same seed, same payload """
+	assert generators.odoo_move_lines(50, seed = 3) == generators.odoo_move_lines(50, seed = 3)
+	assert generators.hubspot_objects(50, seed = 3) != generators.hubspot_objects(50, seed = 4)
+
+def test_benchmark_run_and_compare():
+	""" Every stage runs on a small payload and compares against a baseline """
+	results = run.run(rows = 100)
+	assert set(results) >= {'hs_get_recent_modified', 'get_odoo_model', 'clean_move_line', 'ig_media_insight', 'load_table_from_dataframe_safely'}
+
+	baseline = {f"{stage}@{r['rows']}": {'rows': r['rows'], 'seconds': r['seconds'] / 10, 'peak_mb': r['peak_mb']} for stage, r in results.items()}
+	regressions = run.compare(results, baseline)
+	assert {stage for stage, metric, *_ in regressions if metric == 'seconds'} == set(results)
+
+def test_import_budgets():
+	""" Modules import without the heavy packages they defer, and within budget if VIKUATOOLS_IMPORT_TIMING is set """
+	results, violations = imports.check(timing = bool(os.environ.get('VIKUATOOLS_IMPORT_TIMING')))
+	assert set(results) == set(imports.BUDGETS) and not violations
+	assert vikuatools.__version__ and 'odoo' in dir(vikuatools)
@@ -1,4 +1,26 @@
-from vikuatools.utils import int_to_string
+import datetime as dt
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import xmlrpc.client
+import pandas as pd
+import pytest
+from benchmarks import generators, standins
+from vikuatools import hubspot, instrument, parallel, runner, spill, utils
+from vikuatools.bigquery import load_table_from_dataframe_safely, LocalHashIndex, BigQueryHashIndex
+from vikuatools.hubspot import hs_get_recent_modified, hs_search_modified, hs_extract_value, clean_hubspot_response
+from vikuatools.odoo import (
+	get_odoo_model, odoo_transport, get_odoo_dimension, enrich_move_line, records_to_df,
+	clean_account, clean_analytic_tag, clean_currency_rate, clean_move_line
+	)
+from vikuatools.parallel import parallel_clean
+from vikuatools.schema import TableSchema, register_schema, get_schema
+from vikuatools.spill import clean_segments
+from vikuatools.utils import int_to_string, coerce_datetime
 
 def test_int_to_string():
 	""" Test util function"""
@@ -6,3 +28,412 @@ def test_int_to_string():
 	actual = int_to_string(2)
 
 	assert actual == expected, 'Error in test int_to_string!'
+
+def test_instrument_sinks(tmp_path):
+	""" Stages reach every sink and nothing is recorded without sinks """
+
+	df = pd.DataFrame({'id': [1, 2], 'name': ['a', False]})
+	assert instrument.stage('fetch') is instrument.stage('load')
+
+	registry = instrument.add_sink(instrument.MetricsRegistry())
+	lines = instrument.add_sink(instrument.JsonLinesSink(tmp_path / 'stages.jsonl'))
+	try:
+		clean_analytic_tag(df)
+		with instrument.stage('fetch', source = 'odoo', target = 'account.analytic.tag') as record:
+			record.add_request(100)
+			record.rows = 2
+	finally:
+		instrument.clear_sinks()
+
+	records = [json.loads(x) for x in open(tmp_path / 'stages.jsonl')]
+	assert [(r['stage'], r['target'], r['rows']) for r in records] == [('clean', 'clean_analytic_tag', 2), ('fetch', 'account.analytic.tag', 2)]
+	assert 'vikuatools_stage_bytes_total{stage="fetch",source="odoo",target="account.analytic.tag"} 100' in registry.render()
+	assert not instrument.enabled()
+
+def test_instrument_peak_memory():
+	""" Peak memory is only recorded for stages that do not overlap other threads, and tracing started by the caller is kept """
+
+	records = []
+	barrier = threading.Barrier(2)
+
+	def overlapping(name):
+		with instrument.stage('fetch', target = name):
+			barrier.wait()
+			data = bytearray(10 ** 5)
+			barrier.wait()
+
+	tracemalloc.start()
+	instrument.add_sink(records.append, trace_memory = True)
+	try:
+		with instrument.stage('clean', target = 'alone'):
+			data = bytearray(10 ** 6)
+		threads = [threading.Thread(target = overlapping, args = (name,)) for name in ['a', 'b']]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+	finally:
+		instrument.clear_sinks()
+	assert tracemalloc.is_tracing()
+	tracemalloc.stop()
+
+	peaks = {r['target']: r['peak_bytes'] for r in records}
+	assert peaks['alone'] >= len(data) and peaks['a'] is None and peaks['b'] is None
+
+	instrument.add_sink(records.append, trace_memory = True)
+	instrument.clear_sinks()
+	assert not tracemalloc.is_tracing()
+
+def test_spill_resumes_after_crash(tmp_path):
+	""" A crashed spilled extraction resumes from the last segment and cleans lazily """
+
+	objects = generators.hubspot_objects(250)
+	routes = standins.hubspot_routes(objects)
+	fail_after = {'pages': 2}
+
+	def flaky(query, body, object_type):
+		if fail_after['pages'] == 0:
+			return 500, {'message': 'boom'}
+		fail_after['pages'] -= 1
+		return routes[0][2](query, body, object_type)
+
+	with standins.LocalHTTPServer([('GET', routes[0][1], flaky)]) as server:
+		url = server.url + '/deals/v1/deal/recent/modified?'
+		with pytest.raises(KeyError):
+			hs_get_recent_modified(url, {'count': 100}, 1000, spill_dir = tmp_path, spill_format = 'parquet')
+		fail_after['pages'] = 10
+		spill = hs_get_recent_modified(url, {'count': 100}, 1000, spill_dir = tmp_path)
+
+	assert server.requests == 4 and len(spill) == 250 and spill.complete
+	frames = list(clean_segments(spill, hs_extract_value, ['hs_object_id']))
+	assert [len(df) for df in frames] == [100, 100, 50]
+	assert list(spill)[-1]['dealId'] == objects[-1]['dealId']
+
+def test_clean_segments_bounds_pool_results(tmp_path, monkeypatch):
+	""" Pooled cleaning stays at most processes * 2 segments ahead of the caller, in fetch order """
+
+	submitted = []
+
+	class CountingPool(spill.ProcessPoolExecutor):
+		def submit(self, *args, **kwargs):
+			submitted.append(args[1])
+			return super().submit(*args, **kwargs)
+
+	monkeypatch.setattr(spill, 'ProcessPoolExecutor', CountingPool)
+	segments = spill.SpillDir(tmp_path)
+	rates = generators.odoo_currency_rates(100)
+	for i in range(0, 100, 10):
+		segments.write_segment(rates[i:i + 10])
+
+	cleaned = clean_segments(segments, clean_currency_rate, prepare = records_to_df, processes = 2)
+	first = next(cleaned)
+	assert len(submitted) == 4 and len(first) == 10
+	frames = [first] + list(cleaned)
+	assert submitted == segments.segments and [df['id'].iloc[0] for df in frames] == [str(r['id']) for r in rates[::10]]
+
+def test_spill_dir_is_reset_for_another_request(tmp_path):
+	""" A finished spill_dir is only reused by the request that filled it """
+	move_lines = generators.odoo_move_lines(25)
+	odoo = standins.OdooStandin({'account.move.line': move_lines[:10]})
+	fields = ['id', 'write_date', 'debit']
+
+	assert len(get_odoo_model(odoo, 'db', 2, 'pwd', 'account.move.line', fields, spill_dir = tmp_path)) == 10
+	odoo.records['account.move.line'] = [dict(r, write_date = '2030-01-01 00:00:00') for r in move_lines[10:]]
+	calls = odoo.calls
+	assert len(get_odoo_model(odoo, 'db', 2, 'pwd', 'account.move.line', fields, spill_dir = tmp_path)) == 10 and odoo.calls == calls
+
+	second = get_odoo_model(odoo, 'db', 2, 'pwd', 'account.move.line', fields, checkpoint = '2029/01/01 00:00:00', spill_dir = tmp_path)
+	assert odoo.calls > calls
+	assert [r['id'] for r in second] == [r['id'] for r in move_lines[10:]]
+
+def test_hash_index_skips_unchanged_rows(tmp_path):
+	""" Only rows whose content changed are deleted and reloaded """
+
+	df = pd.DataFrame({'id': ['1', '2', '3'], 'name': ['a', 'b', 'c'], 'tags': [[1], [], [2, 3]], 'write_date': pd.to_datetime(['2022-01-01'] * 3)})
+	changed = df.assign(name = ['a', 'B', 'c'], write_date = pd.to_datetime(['2022-01-01', '2022-02-01', '2022-02-01']))
+	client = standins.FakeBigQueryClient()
+
+	for index in [LocalHashIndex(str(tmp_path / 'index.parquet')), BigQueryHashIndex(client, 'p.d.index', batch_size = 2)]:
+		client.tables.pop('p.d.t', None)
+		load_table_from_dataframe_safely(client, df, 'p.d.t', drop_id_field = 'id', hash_index = index)
+		assert load_table_from_dataframe_safely(client, df, 'p.d.t', drop_id_field = 'id', hash_index = index) is None
+		load_table_from_dataframe_safely(client, changed, 'p.d.t', drop_id_field = 'id', hash_index = index)
+		assert [n for table, n, _ in client.loads if table == 'p.d.t'][-2:] == [3, 1]
+		assert sorted(client.tables['p.d.t']['name']) == ['B', 'a', 'c']
+		# Rows where only write_date moved are skipped, but the newest one is loaded so max(write_date) keeps moving
+		touched = changed.assign(write_date = pd.to_datetime(['2022-03-01', '2022-02-01', '2022-03-02']))
+		load_table_from_dataframe_safely(client, touched, 'p.d.t', drop_id_field = 'id', hash_index = index)
+		assert [n for table, n, _ in client.loads if table == 'p.d.t'][-1] == 1
+		assert client.tables['p.d.t']['write_date'].max() == pd.Timestamp('2022-03-02')
+		load_table_from_dataframe_safely(client, changed, 'p.d.t', drop_id_field = 'id', hash_index = index, exclude_columns = [])
+		assert [n for table, n, _ in client.loads if table == 'p.d.t'][-1] == 3
+	assert sum(q.startswith('DELETE `p.d.index`') for q in client.queries) == 2 + 1 + 1 + 2
+	assert utils.hash_rows(df, []).tolist() == [0, 0, 0] and not utils.hash_rows(df[['id', 'name']]).duplicated().any()
+
+def test_coerce_datetime():
+	""" Per source formats parse to naive UTC unless utc is requested """
+
+	odoo = coerce_datetime(pd.Series(['2022-03-01 10:00:00', False]), source = 'odoo')
+	graph = coerce_datetime(pd.Series(['2022-03-01T10:00:00-0400']), source = 'graph')
+	hubspot = coerce_datetime(pd.DataFrame({'t': ['1646128800000', '']}), source = 'hubspot')
+
+	assert odoo[0] == graph[0] - pd.Timedelta(hours = 4) == hubspot['t'][0] and pd.isnull(odoo[1]) and pd.isnull(hubspot['t'][1])
+	assert str(coerce_datetime(pd.Series(['2022-03-01T10:00:00+0000']), source = 'graph', utc = True).dt.tz) == 'UTC'
+
+def test_hs_search_modified_splits_capped_slices(monkeypatch):
+	""" Slices over the result cap are split and every object is returned once """
+	with monkeypatch.context() as m:
+		m.setenv('TZ', 'America/Caracas')
+		time.tzset()
+		assert hubspot._epoch_ms(dt.datetime(2022, 1, 1)) == hubspot._epoch_ms(dt.datetime(2022, 1, 1, tzinfo = dt.timezone.utc)) == 1640995200000
+	time.tzset()
+
+	objects = generators.hubspot_search_objects(300)
+	with standins.LocalHTTPServer(standins.hubspot_search_routes(objects, result_cap = 40)) as server:
+		found = hs_search_modified('deals', 'token', dt.datetime(2021, 1, 1), dt.datetime(2025, 1, 1), ['dealname', 'amount'], n_slices = 4, max_workers = 4, page_size = 20, result_cap = 40, base_url = server.url)
+
+	assert sorted(o['id'] for o in found) == sorted(o['id'] for o in objects)
+	assert list(hs_extract_value(found, ['hs_object_id', 'dealname']).columns) == ['hs_object_id', 'dealname']
+
+def test_parallel_clean_matches_serial():
+	""" Chunked process pool cleaning returns exactly the serial output """
+
+	rates = pd.DataFrame(generators.odoo_currency_rates(300))
+	pd.testing.assert_frame_equal(parallel_clean(clean_currency_rate, rates, processes = 2), clean_currency_rate(rates))
+
+	# Raw Odoo frames (many2one pairs, tag id lists, False) travel in shared memory and decode unchanged
+	move_lines = records_to_df(generators.odoo_move_lines(200))
+	payload = parallel._encode(move_lines)
+	assert payload[0] == 'shm' and parallel._encode(rates)[0] == 'shm'
+	pd.testing.assert_frame_equal(parallel._decode(payload, unlink = True), move_lines)
+	assert parallel._encode(move_lines.assign(partner_id = [None] + list(move_lines['partner_id'].iloc[1:])))[0] == 'pickle'
+	pd.testing.assert_frame_equal(parallel_clean(clean_move_line, move_lines, processes = 2), clean_move_line(move_lines))
+
+	objects = generators.hubspot_objects(300)
+	properties = generators.HS_DEAL_PROPERTIES
+	pd.testing.assert_frame_equal(parallel_clean(hs_extract_value, objects, properties, processes = 2, chunk_size = 70), hs_extract_value(objects, properties))
+
+	# The resource tracker complains at interpreter exit, so the pool runs in a fresh interpreter
+	code = 'import pandas as pd; from benchmarks import generators; from vikuatools.odoo import clean_currency_rate; from vikuatools.parallel import parallel_clean; parallel_clean(clean_currency_rate, pd.DataFrame(generators.odoo_currency_rates(300)), processes = 2)'
+	proc = subprocess.run([sys.executable, '-c', code], capture_output = True, text = True, check = True, cwd = os.path.dirname(os.path.dirname(__file__)))
+	assert 'resource_tracker' not in proc.stderr
+
+def test_odoo_transports_are_interchangeable():
+	""" get_odoo_model returns the same frame over XML-RPC and JSON-RPC """
+
+	records = {'account.move.line': generators.odoo_move_lines(200)}
+	fields = ['id', 'date', 'write_date', 'account_id', 'analytic_tag_ids', 'debit']
+	with standins.LocalXmlRpcServer(records) as xml_server, standins.LocalHTTPServer(standins.odoo_jsonrpc_routes(standins.OdooStandin(records))) as json_server:
+		frames = []
+		for transport in [odoo_transport(xml_server.url), odoo_transport(json_server.url, 'jsonrpc')]:
+			uid = transport.authenticate('db', 'user', 'pwd')
+			frames.append(get_odoo_model(transport, 'db', uid, 'pwd', 'account.move.line', fields, checkpoint = '2022/06/01 00:00:00'))
+		with pytest.raises(xmlrpc.client.Fault):
+			transport.execute_kw('db', uid, 'pwd', 'account.move.line', 'unlink', [[1]])
+
+	pd.testing.assert_frame_equal(frames[0], frames[1])
+	assert 0 < len(frames[0]) < 200
+
+def test_decode_json_backends(monkeypatch):
+	""" Every decoder backend returns the same document and field subset """
+
+	content = b'{"results": [{"id": 1, "properties": {"a": null}}], "hasMore": true, "offset": 10, "big": [1, 2, 3]}'
+	expected = {'results': [{'id': 1, 'properties': {'a': None}}], 'hasMore': True, 'offset': 10}
+
+	for orjson, simdjson in [(utils.orjson, utils.simdjson), (utils.orjson, None), (None, None)]:
+		monkeypatch.setattr(utils, 'orjson', orjson)
+		monkeypatch.setattr(utils, 'simdjson', simdjson)
+		assert utils.decode_json(content, fields = ['results', 'hasMore', 'offset', 'missing']) == expected
+		assert utils.decode_json(content)['big'] == [1, 2, 3]
+
+def test_odoo_dimension_cache(tmp_path):
+	""" Dimensions are refreshed by write_date, deletions are dropped and cached frames join to move lines """
+
+	accounts = generators.odoo_accounts(50)
+	odoo = standins.OdooStandin({'account.account': accounts})
+	args = (odoo, 'db', 2, 'pwd', 'account.account', ['name', 'code'], clean_account, str(tmp_path))
+
+	first = get_odoo_dimension(*args)
+	assert len(first) == 50 and odoo.calls == 2
+	assert get_odoo_dimension(*args, refresh = False).equals(first) and odoo.calls == 2
+
+	accounts[4].update({'code': 'changed', 'write_date': '2030-01-01 00:00:00'})
+	del accounts[9]
+	refreshed = get_odoo_dimension(*args)
+	assert odoo.calls == 5
+	assert len(refreshed) == 49 and '10' not in set(refreshed['id'])
+	assert refreshed.set_index('id').loc['5', 'account_code'] == 'changed'
+
+	move_lines = clean_move_line(records_to_df(generators.odoo_move_lines(40)))
+	move_lines.index = move_lines.index + 100
+	enriched = enrich_move_line(move_lines, accounts = get_odoo_dimension(*args, refresh = False))
+	assert enriched.index.equals(move_lines.index) and 'account_code' in enriched
+	known = enriched['account_id'].astype(int) <= 50
+	assert enriched.loc[known & (enriched['account_id'] != '10'), 'account_code'].notna().all()
+
+	# Incremental refreshes match a full clean, and every extra filter has its own cache
+	hierarchy = [{'id': 1, 'name': 'Assets - Cash - Bank', 'code': '1', 'write_date': '2021-12-01 00:00:00'}, {'id': 2, 'name': 'Income', 'code': '4', 'write_date': '2022-01-01 00:00:00'}]
+	odoo.records['account.account'] = hierarchy
+	tree_args = (odoo, 'tree', 2, 'pwd', 'account.account', ['name', 'code'], clean_account, str(tmp_path))
+	get_odoo_dimension(*tree_args)
+	hierarchy.append({'id': 3, 'name': 'Expenses', 'code': '5', 'write_date': '2022-02-01 00:00:00'})
+	pd.testing.assert_frame_equal(get_odoo_dimension(*tree_args), clean_account(records_to_df(hierarchy)))
+	filtered = get_odoo_dimension(*tree_args, extra_filters = ['code', '=', '4'])
+	assert list(filtered['id']) == ['2'] and len(get_odoo_dimension(*tree_args, refresh = False)) == 3
+
+	# Another cleaner or other fields never reuse the cache
+	as_tags = get_odoo_dimension(*tree_args[:6], clean_analytic_tag, str(tmp_path))
+	pd.testing.assert_frame_equal(as_tags, clean_analytic_tag(records_to_df(hierarchy)))
+	get_odoo_dimension(odoo, 'fields', 2, 'pwd', 'account.account', ['name'], clean_account, str(tmp_path))
+	hierarchy[0]['write_date'] = '2023-01-01 00:00:00'
+	more_fields = get_odoo_dimension(odoo, 'fields', 2, 'pwd', 'account.account', ['name', 'code'], clean_account, str(tmp_path))
+	assert more_fields['account_code'].notna().all()
+
+def test_schema_drives_parse_cast_and_load():
+	""" One schema spec gives the parse plan, the compact dtypes and a cached explicit load schema """
+
+	register_schema('deals', {
+		'hs_object_id': 'string', 'dealname': 'string', 'dealstage': 'category', 'amount': 'float',
+		'closedate': 'date', 'createdate': 'timestamp', 'hs_lastmodifieddate': 'datetime',
+		'hs_is_closed': 'boolean', 'num_associated_contacts': 'integer', 'lost_reason': {'type': 'string', 'mode': 'NULLABLE'}
+		}, source = 'hubspot')
+	schema = get_schema('deals')
+	assert schema.parse_plan()['to_datetime'] == ['closedate', 'createdate', 'hs_lastmodifieddate']
+
+	df = clean_hubspot_response(generators.hubspot_objects(30), generators.HS_DEAL_PROPERTIES, schema, hs_extract_value)
+	cast = schema.cast(df)
+	assert list(cast.columns) == list(schema.columns) and 'associatedVids' in df
+	assert {c: str(t) for c, t in cast.dtypes.items()} == schema.dtypes
+	with pytest.raises(ValueError, match = 'associatedVids'):
+		TableSchema('deals', schema.columns, source = 'hubspot', strict = True).cast(df)
+	assert cast['lost_reason'].isna().all() and cast['hs_object_id'].iloc[0] == '1000001'
+	assert cast['hs_lastmodifieddate'].equals(df['hs_lastmodifieddate'])
+
+	# Drifted integers load as nulls and round-tripped datetime64[us] columns get the declared unit
+	drifted = df.assign(num_associated_contacts = ['2.5', '3'] + [None] * 28, createdate = df['createdate'].dt.as_unit('us'), hs_lastmodifieddate = df['hs_lastmodifieddate'].dt.as_unit('us'))
+	cast = schema.cast(drifted)
+	assert cast['num_associated_contacts'].iloc[:2].tolist() == [pd.NA, 3]
+	assert {c: str(t) for c, t in cast.dtypes.items()} == schema.dtypes
+
+	bq_client = standins.FakeBigQueryClient()
+	for chunk in [df.iloc[:10], df.iloc[10:]]:
+		load_table_from_dataframe_safely(bq_client, chunk, 'p.d.deals', drop_id_field = 'hs_object_id', schema = 'deals')
+	job_configs = [job_config for _, _, job_config in bq_client.loads]
+	assert job_configs[0] is job_configs[1] is schema.job_config()
+	assert [(f.name, f.field_type) for f in job_configs[0].schema][-3:] == [('hs_is_closed', 'BOOL'), ('num_associated_contacts', 'INT64'), ('lost_reason', 'STRING')]
+	assert bq_client.rows_loaded == 30 and list(bq_client.tables['p.d.deals'].columns) == list(schema.columns)
+
+def test_runner_end_to_end(tmp_path, monkeypatch):
+	""" A spec runs every source through the stand-ins, saves checkpoints after loads and skips dependents of failed jobs """
+
+	objects = generators.hubspot_search_objects(60)
+	odoo = standins.OdooStandin({'account.account': generators.odoo_accounts(30), 'account.move.line': generators.odoo_move_lines(40)})
+	bq_client = standins.FakeBigQueryClient()
+	fulcrum_client = standins.FakeFulcrumClient(generators.fulcrum_rows(25))
+	monkeypatch.setenv('HS_TOKEN', 'token')
+	odoo_args = "odoo_model = {resource = 'odoo'}, db = 'db', uid = 2, password = 'pwd'"
+
+	with standins.LocalHTTPServer(standins.hubspot_search_routes(objects)) as hs, standins.LocalHTTPServer(standins.graph_routes({}, None, generators.graph_user_insights(10))) as graph:
+		spec_path = tmp_path / 'spec.toml'
+		spec_path.write_text(f"""
+			max_workers = 3
+			state = '{tmp_path / 'checkpoints.json'}'
+
+			[sources.odoo]
+			max_concurrency = 1
+
+			[schemas.deals]
+			source = 'hubspot'
+			columns = {{hs_object_id = 'string', amount = 'float', hs_lastmodifieddate = 'datetime', num_associated_contacts = 'integer'}}
+
+			[[jobs]]
+			name = 'deals'
+			source = 'hubspot'
+			fetch = 'vikuatools.hubspot:hs_search_modified'
+			fetch_args = {{object_type = 'deals', token = {{env = 'HS_TOKEN'}}, until = {{now = 'epoch_ms'}}, properties = ['hs_object_id', 'amount', 'hs_lastmodifieddate', 'num_associated_contacts'], base_url = '{hs.url}'}}
+			clean = 'vikuatools.hubspot:clean_hubspot_response'
+			clean_args = {{properties = ['hs_object_id', 'amount', 'hs_lastmodifieddate', 'num_associated_contacts'], parse_column = {{schema = 'deals'}}, extraction_fun = {{ref = 'vikuatools.hubspot:hs_extract_value'}}}}
+			table = 'p.hubspot.deals'
+			drop_id_field = 'hs_object_id'
+			schema = 'deals'
+			checkpoint = {{field = 'hs_lastmodifieddate', argument = 'since', format = 'epoch_ms', default = '2021-01-01'}}
+
+			[[jobs]]
+			name = 'accounts'
+			source = 'odoo'
+			fetch = 'vikuatools.odoo:get_odoo_model'
+			fetch_args = {{{odoo_args}, model_name = 'account.account', fields = ['name', 'code', 'write_date']}}
+			clean = 'vikuatools.odoo:clean_account'
+			table = 'p.odoo.account'
+			drop_id_field = 'id'
+			checkpoint = {{field = 'write_date', argument = 'checkpoint', format = '%Y/%m/%d %H:%M:%S', default = '2000-01-01'}}
+
+			[[jobs]]
+			name = 'move_lines'
+			source = 'odoo'
+			depends_on = ['accounts']
+			fetch = 'vikuatools.odoo:get_odoo_model'
+			fetch_args = {{{odoo_args}, model_name = 'account.move.line', fields = ['date', 'write_date', 'account_id', 'move_id', 'company_id', 'partner_id', 'currency_id', 'journal_id', 'tax_fiscal_country_id', 'analytic_account_id', 'analytic_tag_ids', 'debit']}}
+			clean = 'vikuatools.odoo:clean_move_line'
+			table = 'p.odoo.move_line'
+			drop_id_field = 'id'
+			checkpoint = {{field = 'write_date', argument = 'checkpoint', format = '%Y/%m/%d %H:%M:%S', default = '2000-01-01'}}
+
+			[[jobs]]
+			name = 'user_insights'
+			source = 'instagram'
+			fetch = 'vikuatools.instagram:ig_user_insight'
+			fetch_args = {{endpoint_parameters = {{endpoint_base = '{graph.url}/', instagram_account_id = '1784', access_token = 'token'}}}}
+			table = 'p.instagram.user_insights'
+
+			[[jobs]]
+			name = 'inspections'
+			source = 'fulcrum'
+			fetch = 'vikuatools.fulcrum:query_to_df'
+			fetch_args = {{fulcrum_client = {{resource = 'fulcrum'}}, query = 'SELECT * FROM "inspections"'}}
+			table = 'p.fulcrum.inspections'
+			drop_id_field = '_record_id'
+
+			[[jobs]]
+			name = 'broken'
+			source = 'odoo'
+			fetch = 'vikuatools.odoo:get_odoo_model'
+
+			[[jobs]]
+			name = 'after_broken'
+			source = 'odoo'
+			depends_on = ['broken']
+			fetch = 'vikuatools.odoo:get_odoo_model'
+			""".replace('\n\t\t\t', '\n'))
+
+		spec = runner.load_spec(spec_path)
+		resources = {'bigquery': bq_client, 'odoo': odoo, 'fulcrum': fulcrum_client}
+		results = {r['job']: r for r in runner.run_spec(spec, resources = resources)}
+
+		assert {job: r['status'] for job, r in results.items()} == {
+			'deals': 'ok', 'accounts': 'ok', 'move_lines': 'ok', 'user_insights': 'ok', 'inspections': 'ok', 'broken': 'failed', 'after_broken': 'skipped'}
+		assert [results[job]['rows'] for job in ['deals', 'accounts', 'move_lines', 'inspections']] == [60, 30, 40, 25]
+		assert len(bq_client.tables['p.hubspot.deals']) == 60 and len(bq_client.tables['p.odoo.move_line']) == 40
+		assert [job_config.schema[0].name for table, _, job_config in bq_client.loads if table == 'p.hubspot.deals'] == ['hs_object_id']
+		checkpoints = json.loads((tmp_path / 'checkpoints.json').read_text())
+		assert set(checkpoints) == {'deals', 'accounts', 'move_lines'}
+		assert 'TypeError' in results['broken']['error'] and 'job' in runner.format_summary(results.values())
+
+		# checkpoints are passed on the next run, nothing changed in odoo
+		again = {r['job']: r for r in runner.run_spec(spec, resources = resources, only = ['move_lines'])}
+		assert set(again) == {'accounts', 'move_lines'} and again['move_lines']['rows'] == 0
+		assert again['accounts']['checkpoint'] == checkpoints['accounts'].replace('-', '/').replace('T', ' ')
+
+	# Without a state file the checkpoint comes from the table, or the default if it does not exist yet
+	fresh = {'jobs': [{
+		'name': 'fresh', 'source': 'odoo', 'fetch': 'vikuatools.odoo:get_odoo_model', 'table': 'p.odoo.fresh', 'drop_id_field': 'id',
+		'fetch_args': {'odoo_model': {'resource': 'odoo'}, 'db': 'db', 'uid': 2, 'password': 'pwd', 'model_name': 'account.account', 'fields': ['name', 'write_date']},
+		'checkpoint': {'field': 'write_date', 'argument': 'checkpoint', 'format': '%Y/%m/%d %H:%M:%S', 'default': '2000-01-01'}
+		}]}
+	first, = runner.run_spec(fresh, resources = resources)
+	assert first['status'] == 'ok' and first['checkpoint'] == '2000/01/01 00:00:00' and first['rows'] == 30
+	second, = runner.run_spec(fresh, resources = resources)
+	assert second['checkpoint'] == '2022/01/01 00:29:00' and second['rows'] == 0
+
+	with pytest.raises(ValueError, match = 'cycle'):
+		runner.plan([{'name': 'a', 'fetch': 'm:f', 'depends_on': ['b']}, {'name': 'b', 'fetch': 'm:f', 'depends_on': ['a']}])